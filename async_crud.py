@@ -0,0 +1,218 @@
+from fastapi import HTTPException
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import auth_cache
+import crud
+import models
+import pagination
+import passwords
+import rollups
+import schemas
+
+# AsyncSession versions of the hot read paths in crud.py. Query construction
+# is shared with crud where it is more than a one-liner.
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await passwords.get_password_hash(user.password)
+    db_user = models.User(username=user.username, hashed_password=hashed_password, role=user.role)
+    db.add(db_user)
+    await db.commit()
+    auth_cache.principals.invalidate_user(db_user.username)
+    await db.refresh(db_user)
+    return db_user
+
+async def get_pws_by_id(db: AsyncSession, pwsid: str):
+    return await db.get(models.PublicWaterSystem, pwsid)
+
+async def get_pws_by_ids(db: AsyncSession, pwsids: list):
+    """Fetches several systems in one query, preserving the order of `pwsids`."""
+    systems = await db.scalars(select(models.PublicWaterSystem).where(models.PublicWaterSystem.pwsid.in_(pwsids)))
+    by_id = {system.pwsid: system for system in systems}
+    return [by_id[pwsid] for pwsid in pwsids if pwsid in by_id]
+
+def _select(model, fields: list = None):
+    if fields is None:
+        return select(model)
+    return select(*[getattr(model, field) for field in fields])
+
+async def search_systems(db: AsyncSession, query: str, limit: int = 50, cursor: str = None, fields: list = None):
+    criterion, order_by = crud.search_criteria(query)
+    statement = _select(models.PublicWaterSystem, fields).where(criterion)
+    return await pagination.paginate_with_cursor_async(db, statement, order_by, limit, cursor)
+
+async def get_water_system_status(db: AsyncSession, pwsid: str):
+    status = await db.scalar(select(models.SystemStatus.status).where(models.SystemStatus.pwsid == pwsid))
+    if status is not None:
+        return status
+
+    # Not materialized yet (e.g. before the first ingest), count live.
+    health_based_violations = await db.scalar(
+        select(func.count()).select_from(models.Violation).where(
+            models.Violation.pwsid == pwsid,
+            crud.active_health_based_filter()
+        )
+    )
+    return crud.status_from_count(health_based_violations)
+
+STATISTICS_DIMENSIONS = ("county", "pws_type_code", "gw_sw_code", "contaminant", "quarter")
+STATISTICS_KEYS = ("total_systems", "total_systems_with_violations", "active_systems_with_violations")
+
+# Rows of the rollup query for one dimension (and value), counted from the
+# raw tables. Planning pushes the dimension into each UNION ALL branch, so
+# only that dimension's branch is aggregated.
+_LIVE_STATISTICS_SQL = text(f"""
+    SELECT * FROM ({rollups.STATISTICS_ROLLUP_SQL}) rollup
+    WHERE dimension = CAST(:dimension AS text)
+      AND (CAST(:value AS text) IS NULL OR value = CAST(:value AS text))
+    ORDER BY value;
+""")
+
+def _statistics_counts(row):
+    return {key: getattr(row, key) for key in STATISTICS_KEYS}
+
+async def _rollup_rows(db: AsyncSession, dimension: str, value: str = None):
+    """statistics_rollup rows for `dimension` (and `value`); counted live if no ingest has built them yet."""
+    # The statewide row is written with every other one, so it marks a built rollup.
+    if await db.get(models.StatisticsRollup, ("all", "")) is None:
+        return (await db.execute(_LIVE_STATISTICS_SQL, {"dimension": dimension, "value": value})).all()
+    if value is not None:
+        row = await db.get(models.StatisticsRollup, (dimension, value))
+        return [row] if row is not None else []
+    return (await db.scalars(
+        select(models.StatisticsRollup)
+        .where(models.StatisticsRollup.dimension == dimension)
+        .order_by(models.StatisticsRollup.value)
+    )).all()
+
+async def get_system_statistics(db: AsyncSession, filters: dict = None, breakdown: str = None):
+    """Reads statistics from the ingest-time rollup: statewide, for one dimension value, or broken down.
+
+    Every variant is a primary-key lookup or a single-dimension range scan,
+    so the cost doesn't grow with the violations table.
+    """
+    filters = {dimension: value for dimension, value in (filters or {}).items() if value is not None}
+    if len(filters) > 1 or (filters and breakdown):
+        raise HTTPException(status_code=400, detail="Filter or break down by one dimension at a time.")
+
+    if breakdown is not None:
+        if breakdown not in STATISTICS_DIMENSIONS:
+            raise HTTPException(status_code=400, detail=f"Unknown breakdown: {breakdown}")
+        rows = await _rollup_rows(db, breakdown)
+        return {"breakdown": breakdown, "rows": [{breakdown: row.value, **_statistics_counts(row)} for row in rows]}
+
+    if filters:
+        (dimension, value), = filters.items()
+        rows = await _rollup_rows(db, dimension, value)
+        if not rows:
+            raise HTTPException(status_code=404, detail=f"No systems with {dimension} {value}")
+        return {dimension: value, **_statistics_counts(rows[0])}
+
+    (row,) = await _rollup_rows(db, "all", "")
+    return _statistics_counts(row)
+
+async def get_nearest_pwsids(db: AsyncSession, lat: float, lon: float, limit: int = 1, max_distance_m: float = None):
+    """Returns the pwsids of the `limit` nearest distinct systems, nearest first."""
+    candidates = await db.scalars(
+        crud.nearest_statement(lat, lon, limit, max_distance_m, entity=models.GeographicArea.pwsid)
+    )
+    return list(dict.fromkeys(candidates))[:limit]
+
+async def get_dataset_state(db: AsyncSession):
+    """Returns (version, updated_at) of the last ingest, or (0, None) before the first one."""
+    row = (await db.execute(
+        select(models.DatasetVersion.version, models.DatasetVersion.updated_at).where(models.DatasetVersion.id == 1)
+    )).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+async def get_system_changed_at(db: AsyncSession, pwsid: str):
+    """When the system's status row was last rewritten, by an ingest or an acknowledgement; None without one."""
+    return await db.scalar(select(models.SystemStatus.refreshed_at).where(models.SystemStatus.pwsid == pwsid))
+
+_NEAREST_FOR_POINTS_SQL = text("""
+    SELECT nearest.pwsid
+    FROM unnest(CAST(:lats AS float8[]), CAST(:lons AS float8[])) WITH ORDINALITY AS point(lat, lon, position)
+    LEFT JOIN LATERAL (
+        SELECT g.pwsid
+        FROM sdwa_geographic_areas g
+        WHERE g.geom IS NOT NULL
+        ORDER BY g.geom <-> ST_SetSRID(ST_MakePoint(point.lon, point.lat), 4326)
+        LIMIT 1
+    ) nearest ON true
+    ORDER BY point.position;
+""")
+
+async def get_nearest_pwsids_for_points(db: AsyncSession, points: list):
+    """Resolves the nearest system for every (lat, lon) in one round trip, with one KNN probe per point."""
+    if not points:
+        return []
+    rows = await db.execute(_NEAREST_FOR_POINTS_SQL, {
+        "lats": [lat for lat, _ in points],
+        "lons": [lon for _, lon in points],
+    })
+    return list(rows.scalars())
+
+async def get_violation_counts(db: AsyncSession, pwsids: list):
+    """Returns {pwsid: (all, health-based, active health-based)} violation counts in one grouped query."""
+    health_based = models.Violation.is_health_based_ind == 'Y'
+    rows = await db.execute(
+        select(
+            models.Violation.pwsid,
+            func.count(),
+            func.count().filter(health_based),
+            func.count().filter(crud.active_health_based_filter())
+        ).where(models.Violation.pwsid.in_(pwsids)).group_by(models.Violation.pwsid)
+    )
+    return {pwsid: counts for pwsid, *counts in rows}
+
+async def get_systems_batch(db: AsyncSession, pwsids: list, points: list):
+    """Looks up systems with status and violation counts, plus the nearest system to each point.
+
+    Three queries regardless of batch size: the nearest-system probes, the
+    systems, and their grouped violation counts.
+    """
+    in_georgia = [crud.is_in_georgia(lat, lon) for lat, lon in points]
+    nearest = iter(await get_nearest_pwsids_for_points(
+        db, [point for point, inside in zip(points, in_georgia) if inside]
+    ))
+    point_pwsids = [next(nearest) if inside else None for inside in in_georgia]
+
+    requested = list(dict.fromkeys(pwsids))
+    wanted = list(dict.fromkeys(requested + [pwsid for pwsid in point_pwsids if pwsid]))
+    systems = await get_pws_by_ids(db, wanted)
+    counts = await get_violation_counts(db, wanted)
+
+    entries = []
+    for system in systems:
+        violation_count, health_based_count, active_count = counts.get(system.pwsid, (0, 0, 0))
+        entries.append({
+            "system": system,
+            "status": crud.status_from_count(active_count),
+            "violation_count": violation_count,
+            "health_based_violation_count": health_based_count,
+            "active_violation_count": active_count,
+        })
+
+    found = {system.pwsid for system in systems}
+    return {
+        "systems": entries,
+        "points": [
+            {"lat": lat, "lon": lon, "pwsid": pwsid}
+            for (lat, lon), pwsid in zip(points, point_pwsids)
+        ],
+        "not_found": [pwsid for pwsid in requested if pwsid not in found],
+    }
+
+async def get_system_history(db: AsyncSession, pwsid: str, limit: int = 500, cursor: str = None,
+                             start_date=None, end_date=None, section_limits: dict = None):
+    """`crud.get_system_history` on an AsyncSession: one statement for every section."""
+    after, sections, limits = crud.history_pages(limit, cursor, section_limits)
+    if not sections:
+        return crud.system_history_from_row(None, sections, limits)
+    row = (await db.execute(
+        crud.system_history_statement(pwsid, sections, limits, after, start_date, end_date)
+    )).one()
+    return crud.system_history_from_row(row, sections, limits)
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import metrics
+
+# Verified bearer token -> user, so authenticated requests skip the JWT decode
+# and the user lookup. An entry expires with its token's `exp`, and after
+# AUTH_CACHE_TTL_SECONDS at the latest: invalidation is per process, so the TTL
+# bounds how long another worker can serve a user that has since changed.
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+
+class PrincipalCache:
+    """Thread-safe LRU of token -> user with a per-entry deadline, indexed by username for invalidation."""
+
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES, ttl: float = AUTH_CACHE_TTL_SECONDS):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._tokens_by_username = defaultdict(set)
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[2] <= time.time():
+                self._remove(token)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self._hits += 1
+            return entry[0]
+
+    def set(self, token: str, user, expires_at: float = None):
+        """Caches `user` for `token` until the token's `exp` (a Unix timestamp) or the TTL, whichever is first."""
+        now = time.time()
+        deadline = now + self._ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        if deadline <= now:
+            return
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (user, user.username, deadline)
+            self._tokens_by_username[user.username].add(token)
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, username: str):
+        """Drops every cached token of `username`, e.g. after the user is changed."""
+        with self._lock:
+            for token in list(self._tokens_by_username.get(username, ())):
+                self._remove(token)
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_username[entry[1]]
+        tokens.discard(token)
+        if not tokens:
+            del self._tokens_by_username[entry[1]]
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+principals = PrincipalCache()
+metrics.register_gauge("auth_cache", principals.stats)
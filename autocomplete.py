@@ -0,0 +1,74 @@
+import heapq
+from bisect import bisect_left
+
+from sqlalchemy.orm import Session
+
+import crud
+from snapshot import VersionedSnapshot
+
+MAX_LIMIT = 25
+# Prefixes this short match thousands of keys, so their answers are precomputed.
+PRECOMPUTED_PREFIX_LENGTH = 3
+
+
+def normalize(text):
+    return " ".join(str(text).lower().split()) if text else ""
+
+
+class PrefixIndex:
+    """Sorted-key prefix index over system names, cities, zip codes and pwsids.
+
+    Systems are ranked by population served, so a lookup returns the most
+    populous systems having any key that starts with the query. Every
+    word-suffix of a name is a key, so "atlanta" also matches "City of Atlanta".
+    """
+
+    def __init__(self, systems):
+        # Lower position means higher rank.
+        self._systems = sorted(systems, key=lambda s: (-(s["population_served_count"] or 0), s["pwsid"]))
+        pairs = set()
+        for rank, system in enumerate(self._systems):
+            words = normalize(system["pws_name"]).split()
+            for i in range(len(words)):
+                pairs.add((" ".join(words[i:]), rank))
+            for field in ("city_name", "pwsid"):
+                if system[field]:
+                    pairs.add((normalize(system[field]), rank))
+            if system["zip_code"]:
+                pairs.add((normalize(system["zip_code"])[:5], rank))
+        pairs = sorted(pairs)
+        self._keys = [key for key, _ in pairs]
+        self._ranks = [rank for _, rank in pairs]
+        self._precomputed = self._precompute()
+
+    def __len__(self):
+        return len(self._systems)
+
+    def _range(self, prefix):
+        return bisect_left(self._keys, prefix), bisect_left(self._keys, prefix + "\uffff")
+
+    def _top_ranks(self, prefix, limit):
+        lo, hi = self._range(prefix)
+        return heapq.nsmallest(limit, set(self._ranks[lo:hi]))
+
+    def _precompute(self):
+        prefixes = {key[:length] for key in self._keys for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1)}
+        return {prefix: self._top_ranks(prefix, MAX_LIMIT) for prefix in prefixes}
+
+    def lookup(self, query, limit=10):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_LIMIT)
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            ranks = self._precomputed.get(prefix, [])[:limit]
+        else:
+            ranks = self._top_ranks(prefix, limit)
+        return [self._systems[rank] for rank in ranks]
+
+
+def build_from_db(db: Session):
+    return PrefixIndex([dict(row._mapping) for row in crud.get_autocomplete_rows(db)])
+
+
+snapshot = VersionedSnapshot("autocomplete index", build_from_db)
@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from decimal import Decimal
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import lru_cache
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+import metrics
+
+try:
+    from pydantic import TypeAdapter
+except ImportError:  # pydantic v1, where orm_mode schemas accept ORM rows directly
+    TypeAdapter = None
+
+try:
+    import orjson
+except ImportError:  # optional; the fast path then skips validation but still uses json.dumps
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# "memory" (per process), "redis" (shared by all workers) or "none".
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# How often the dataset version written by scripts/ingest_data.py is re-read.
+VERSION_CHECK_INTERVAL = float(os.getenv("CACHE_VERSION_CHECK_INTERVAL", "10"))
+# Lets endpoints whose crud rows are already shaped like the response skip
+# schema validation and encode with orjson; see scripts/benchmark_json.py.
+JSON_FAST_PATH = os.getenv("JSON_FAST_PATH", "false").lower() == "true"
+
+
+class MemoryBackend:
+    """Thread-safe LRU with a per-entry TTL, local to the process."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class RedisBackend:
+    """Wraps any client with redis-py's get/set(ex=), e.g. a fakeredis instance in tests."""
+
+    def __init__(self, client):
+        self._client = client
+
+    @classmethod
+    def from_url(cls, url: str):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key: str):
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int = None):
+        self._client.set(key, value, ex=ttl)
+
+
+def _create_backend():
+    if CACHE_BACKEND == "redis":
+        return RedisBackend.from_url(CACHE_REDIS_URL)
+    if CACHE_BACKEND == "memory":
+        return MemoryBackend()
+    return None
+
+backend = _create_backend()
+# None until the first poll, so nothing is cached against an unknown dataset.
+dataset_version = None
+dataset_updated_at = None
+
+
+async def poll_dataset_version(session_factory, read_state, interval: float = VERSION_CHECK_INTERVAL, on_version=None):
+    """Keeps `dataset_version` current; a bump by ingest moves every key to a fresh namespace.
+
+    `on_version(version)`, if given, is awaited after every successful read.
+    """
+    global dataset_version, dataset_updated_at
+    while True:
+        try:
+            async with session_factory() as db:
+                dataset_version, dataset_updated_at = await read_state(db)
+        except Exception:
+            logger.exception("Could not read the dataset version, keeping %s", dataset_version)
+        else:
+            if on_version is not None:
+                try:
+                    await on_version(dataset_version)
+                except Exception:
+                    logger.exception("Could not act on dataset version %s", dataset_version)
+        await asyncio.sleep(interval)
+
+def _response_key(endpoint: str, params: dict, changed_at=None):
+    parts = [endpoint, f"v{dataset_version}"]
+    if changed_at is not None:
+        parts.append(f"c{changed_at.isoformat()}")
+    parts += [f"{name}={params[name]}" for name in sorted(params)]
+    # Entries hold the body's ETag ahead of the body; the prefix keeps them
+    # apart from bare bodies stored by earlier releases.
+    return "etagged-response:" + "|".join(parts)
+
+def _last_modified(changed_at=None):
+    """The later of the last ingest and `changed_at`, or None when neither is known."""
+    known = [moment for moment in (dataset_updated_at, changed_at) if moment is not None]
+    return max(known) if known else None
+
+def _etag(body: bytes):
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+# A quoted hex SHA-1.
+_ETAG_LENGTH = 42
+
+def _pack(etag: str, body: bytes):
+    return etag.encode() + body
+
+def _unpack(entry: bytes):
+    return entry[:_ETAG_LENGTH].decode(), entry[_ETAG_LENGTH:]
+
+def _validators(etag: str, last_modified=None):
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def _not_modified(request: Request, headers: dict, last_modified=None):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == headers["ETag"] for tag in tags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole-second precision.
+    return last_modified.replace(microsecond=0) <= since
+
+@lru_cache(maxsize=None)
+def _adapter(schema):
+    return TypeAdapter(schema)
+
+def _validate(schema, value):
+    if TypeAdapter is None:
+        return parse_obj_as(schema, value)
+    return _adapter(schema).validate_python(value, from_attributes=True)
+
+def encode(value, schema=None):
+    """Serializes like FastAPI's JSONResponse, validating through `schema` (e.g. for ORM rows) first."""
+    if schema is not None:
+        value = _validate(schema, value)
+    return json.dumps(
+        jsonable_encoder(value), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+def _fast_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def encode_fast(value):
+    """Serializes dicts, lists and scalars like `encode`, without validation.
+
+    Under orjson floats can differ from `encode`. Exponents are spelled
+    differently (1e-05 as 0.00001, 1e+16 as 1e16) but parse to the same
+    numbers. NaN and infinities become null, where `encode` raises.
+    scripts/benchmark_json.py prints the cases.
+    """
+    if orjson is None:
+        return json.dumps(
+            value, default=_fast_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+    return orjson.dumps(value, default=_fast_default)
+
+async def _resolve(value):
+    return await value if inspect.isawaitable(value) else value
+
+async def cached_response(endpoint: str, compute, render, media_type: str, request: Request = None,
+                          changed_at=None, **params):
+    """Returns the cached body for (endpoint, params), computing and storing it on a miss.
+
+    `compute` may return a value or an awaitable; `render` turns it into
+    bytes. Responses that can change between ingests pass `changed_at`,
+    which returns (or awaits to) the time of the last such change, e.g. a
+    system's `system_status.refreshed_at`. It is read from the database,
+    so every worker moves to a fresh key together; read it on the session
+    `compute` uses so a lagging replica can't store old rows under the new
+    time. The ETag is a hash of the body, stored next to it, so a
+    conditional `request` gets a 304 only for the body it would have
+    received. Backend errors degrade to an uncached response rather than
+    failing the request.
+    """
+    key, entry, last_modified = None, None, None
+    try:
+        if backend is not None and dataset_version is not None:
+            changed = await _resolve(changed_at()) if changed_at is not None else None
+            key = _response_key(endpoint, params, changed)
+            last_modified = _last_modified(changed)
+            entry = backend.get(key)
+    except Exception:
+        logger.exception("Cache lookup failed for %s", endpoint)
+
+    if entry is not None:
+        metrics.increment(f"cache_{endpoint}_hits")
+        etag, body = _unpack(entry)
+    else:
+        metrics.increment(f"cache_{endpoint}_misses")
+        body = render(await _resolve(compute()))
+        etag = _etag(body)
+        if key:
+            try:
+                backend.set(key, _pack(etag, body), CACHE_TTL_SECONDS)
+            except Exception:
+                logger.exception("Cache store failed for %s", endpoint)
+
+    headers = _validators(etag, last_modified)
+    if request is not None and _not_modified(request, headers, last_modified):
+        metrics.increment(f"cache_{endpoint}_not_modified")
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+async def cached_json(endpoint: str, compute, schema=None, request: Request = None, changed_at=None,
+                      fast: bool = False, **params):
+    """`cached_response` for JSON, validated through `schema` when given.
+
+    `fast` marks endpoints whose `compute` already returns response-shaped
+    dicts; with JSON_FAST_PATH enabled they skip `schema` and use `encode_fast`,
+    whose floats may be spelled differently.
+    """
+    render = encode_fast if fast and JSON_FAST_PATH else lambda value: encode(value, schema)
+    return await cached_response(endpoint, compute, render, "application/json", request, changed_at, **params)
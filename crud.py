@@ -1,5 +1,13 @@
+import math
+import re
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
+import auth_cache
 import models
+import pagination
 import schemas
 from passlib.context import CryptContext
 
@@ -19,42 +27,137 @@ def create_user(db: Session, user: schemas.UserCreate):
     db_user = models.User(username=user.username, hashed_password=hashed_password, role=user.role)
     db.add(db_user)
     db.commit()
+    auth_cache.principals.invalidate_user(db_user.username)
     db.refresh(db_user)
     return db_user
 
 def get_pws_by_id(db: Session, pwsid: str):
     return db.query(models.PublicWaterSystem).filter(models.PublicWaterSystem.pwsid == pwsid).first()
 
-def get_pws_by_name(db: Session, name: str):
-    return db.query(models.PublicWaterSystem).filter(models.PublicWaterSystem.pws_name.ilike(f"%{name}%")).all()
+def get_pws_by_ids(db: Session, pwsids: list):
+    """Fetches several systems in one query, preserving the order of `pwsids`."""
+    systems = db.query(models.PublicWaterSystem).filter(models.PublicWaterSystem.pwsid.in_(pwsids)).all()
+    by_id = {system.pwsid: system for system in systems}
+    return [by_id[pwsid] for pwsid in pwsids if pwsid in by_id]
+
+def _contains_pattern(text: str):
+    # Backslash is the default LIKE escape character in Postgres.
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def _query(db: Session, model, fields: list = None):
+    """Selects whole ORM rows, or only `fields` when a projection was requested."""
+    if fields is None:
+        return db.query(model)
+    return db.query(*[getattr(model, field) for field in fields])
+
+def get_pws_by_name(db: Session, name: str, limit: int = 50, cursor: str = None, fields: list = None):
+    # The trigram GIN index on pws_name serves the ILIKE; similarity() ranks the closest names first.
+    systems = _query(db, models.PublicWaterSystem, fields).filter(
+        models.PublicWaterSystem.pws_name.ilike(_contains_pattern(name))
+    )
+    return pagination.paginate_with_cursor(systems, [
+        (func.similarity(models.PublicWaterSystem.pws_name, name), True),
+        (models.PublicWaterSystem.pwsid, False),
+    ], limit, cursor)
 
-def get_pws_by_zip(db: Session, zip_code: str):
-    return db.query(models.PublicWaterSystem).filter(models.PublicWaterSystem.zip_code == zip_code).all()
+def get_pws_by_zip(db: Session, zip_code: str, limit: int = 50, cursor: str = None, fields: list = None):
+    systems = _query(db, models.PublicWaterSystem, fields).filter(models.PublicWaterSystem.zip_code == zip_code)
+    return pagination.paginate_with_cursor(systems, [(models.PublicWaterSystem.pwsid, False)], limit, cursor)
 
-from sqlalchemy import or_
-from geoalchemy2.functions import ST_Distance
+from sqlalchemy import and_, case, cast, func, or_, select
 from geoalchemy2.types import Geography
 
-def get_violations_by_pwsid(db: Session, pwsid: str):
-    return db.query(models.Violation).filter(models.Violation.pwsid == pwsid).all()
+def get_violations_by_pwsid(db: Session, pwsid: str, limit: int = 100, cursor: str = None, fields: list = None):
+    violations = _query(db, models.Violation, fields).filter(models.Violation.pwsid == pwsid)
+    return pagination.paginate_with_cursor(violations, [(models.Violation.violation_id, False)], limit, cursor)
 
-def search_systems(db: Session, query: str):
+# Two-letter state code followed by digits, e.g. "GA01" or "GA0010000".
+PWSID_PREFIX_PATTERN = re.compile(r"^[A-Za-z]{2}\d{1,7}$")
+
+def search_criteria(query: str):
+    """Returns the (filter, order_by) pair for a free-text system search."""
+    query = query.strip()
+    order_by = [(models.PublicWaterSystem.pwsid, False)]
     if query.isdigit() and len(query) == 5:
-        return db.query(models.PublicWaterSystem).filter(models.PublicWaterSystem.zip_code == query).all()
-    return db.query(models.PublicWaterSystem).filter(
-        or_(
-            models.PublicWaterSystem.pwsid.ilike(f"%{query}%"),
-            models.PublicWaterSystem.pws_name.ilike(f"%{query}%")
-        )
-    ).all()
+        return models.PublicWaterSystem.zip_code == query, order_by
+    if PWSID_PREFIX_PATTERN.match(query):
+        # Anchored prefix match, served by the varchar_pattern_ops index on pwsid.
+        return models.PublicWaterSystem.pwsid.like(f"{query.upper()}%"), order_by
+
+    pattern = _contains_pattern(query)
+    rank = func.greatest(
+        func.similarity(models.PublicWaterSystem.pws_name, query),
+        func.similarity(models.PublicWaterSystem.pwsid, query)
+    )
+    criterion = or_(
+        models.PublicWaterSystem.pwsid.ilike(pattern),
+        models.PublicWaterSystem.pws_name.ilike(pattern)
+    )
+    return criterion, [(rank, True), *order_by]
+
+def search_systems(db: Session, query: str, limit: int = 50, cursor: str = None, fields: list = None):
+    criterion, order_by = search_criteria(query)
+    systems = _query(db, models.PublicWaterSystem, fields).filter(criterion)
+    return pagination.paginate_with_cursor(systems, order_by, limit, cursor)
+
+def active_health_based_filter():
+    """Predicate for health-based violations whose non-compliance period is still open."""
+    return and_(
+        models.Violation.is_health_based_ind == 'Y',
+        models.Violation.non_compl_per_end_date == None
+    )
+
+def status_from_count(active_violation_count):
+    return "safe" if not active_violation_count else "not safe"
+
+def status_column(pwsid):
+    """The system_status verdict for `pwsid`, checked live for systems without a row (e.g. before the first ingest).
+
+    The query must outer join SystemStatus. COALESCE only evaluates the live
+    check, a probe of the partial active-violation index, when the row is missing.
+    """
+    has_active_violations = select(models.Violation.pwsid).where(
+        models.Violation.pwsid == pwsid, active_health_based_filter()
+    ).exists()
+    return func.coalesce(
+        models.SystemStatus.status,
+        case((has_active_violations, status_from_count(1)), else_=status_from_count(0))
+    )
 
 def get_water_system_status(db: Session, pwsid: str):
+    system_status = db.query(models.SystemStatus.status).filter(models.SystemStatus.pwsid == pwsid).first()
+    if system_status is not None:
+        return system_status.status
+
+    # Not materialized yet (e.g. before the first ingest), count live.
     health_based_violations = db.query(models.Violation).filter(
         models.Violation.pwsid == pwsid,
-        models.Violation.is_health_based_ind == 'Y',
-        models.Violation.non_compl_per_end_date == None
+        active_health_based_filter()
     ).count()
-    return "safe" if health_based_violations == 0 else "not safe"
+    return status_from_count(health_based_violations)
+
+def refresh_system_status(db: Session, pwsid: str):
+    """Recomputes the materialized status row for a single system. The caller commits."""
+    active_violation_count, last_violation_date = db.query(
+        func.count(models.Violation.violation_id).filter(models.Violation.non_compl_per_end_date == None),
+        func.max(models.Violation.non_compl_per_begin_date)
+    ).filter(
+        models.Violation.pwsid == pwsid,
+        models.Violation.is_health_based_ind == 'Y'
+    ).one()
+
+    values = {
+        "active_violation_count": active_violation_count,
+        "last_violation_date": last_violation_date,
+        "status": status_from_count(active_violation_count),
+        "refreshed_at": func.now(),
+    }
+    db.execute(
+        insert(models.SystemStatus)
+        .values(pwsid=pwsid, **values)
+        .on_conflict_do_update(index_elements=[models.SystemStatus.pwsid], set_=values)
+    )
 
 def get_system_statistics(db: Session):
     total_systems = db.query(models.PublicWaterSystem).count()
@@ -66,8 +169,7 @@ def get_system_statistics(db: Session):
 
     # Active health-based violations
     active_systems_with_violations = db.query(models.PublicWaterSystem.pwsid).join(models.Violation).filter(
-        models.Violation.is_health_based_ind == 'Y',
-        models.Violation.non_compl_per_end_date == None
+        active_health_based_filter()
     ).distinct().count()
 
     return {
@@ -76,48 +178,176 @@ def get_system_statistics(db: Session):
         "active_systems_with_violations": active_systems_with_violations
     }
 
-def get_nearest_system(db: Session, lat: float, lon: float):
-    return db.query(models.GeographicArea).order_by(
-        ST_Distance(
-            models.GeographicArea.geom,
-            f'POINT({lon} {lat})'
+# A system can have several geographic areas; scan this many KNN candidates
+# per requested system so duplicates can be collapsed.
+NEAREST_SCAN_FACTOR = 4
+
+# Lower bounds on the length of a degree on the WGS84 spheroid: a degree of
+# latitude is at least this long, a degree of longitude at least this times
+# cos(latitude).
+METRES_PER_DEGREE_LAT = 110_574
+METRES_PER_DEGREE_LON_AT_EQUATOR = 111_319
+
+def degree_margins(lat: float, metres: float):
+    """(dx, dy) in degrees of a box around a point at `lat` that holds everything within `metres` of it."""
+    dy = metres / METRES_PER_DEGREE_LAT
+    # Degrees of longitude are shortest at the box's edge farthest from the equator.
+    cos_lat = math.cos(math.radians(min(abs(lat) + dy, 90)))
+    if metres >= 180 * METRES_PER_DEGREE_LON_AT_EQUATOR * cos_lat:
+        return 180, dy
+    return metres / (METRES_PER_DEGREE_LON_AT_EQUATOR * cos_lat), dy
+
+def nearest_statement(lat: float, lon: float, limit: int, max_distance_m: float = None, entity=models.GeographicArea):
+    """Selects `entity` for the KNN candidates of the `limit` nearest systems, nearest first.
+
+    Ordering uses the `<->` operator so PostGIS can walk the GiST index on
+    `geom` instead of sorting every row by ST_Distance. A `max_distance_m`
+    first bounds the walk with a degree box the index can use; the geography
+    check then applies the exact distance.
+    """
+    point = func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326)
+    statement = select(entity).where(models.GeographicArea.geom != None)
+    if max_distance_m is not None:
+        statement = statement.where(
+            models.GeographicArea.geom.intersects(func.ST_Expand(point, *degree_margins(lat, max_distance_m))),
+            func.ST_DWithin(
+                cast(models.GeographicArea.geom, Geography),
+                cast(point, Geography),
+                max_distance_m
+            )
         )
-    ).first()
+    return statement.order_by(
+        models.GeographicArea.geom.distance_centroid(point)
+    ).limit(limit * NEAREST_SCAN_FACTOR)
+
+def get_nearest_systems(db: Session, lat: float, lon: float, limit: int = 1, max_distance_m: float = None):
+    """Returns the geographic areas of the `limit` nearest distinct systems, nearest first."""
+    candidates = db.execute(nearest_statement(lat, lon, limit, max_distance_m)).scalars().all()
+
+    nearest, seen = [], set()
+    for area in candidates:
+        if area.pwsid not in seen:
+            seen.add(area.pwsid)
+            nearest.append(area)
+    return nearest[:limit]
+
+def get_nearest_system(db: Session, lat: float, lon: float):
+    nearest = get_nearest_systems(db, lat=lat, lon=lon, limit=1)
+    return nearest[0] if nearest else None
+
+GEORGIA_LAT_RANGE = (30.3, 35.0)
+GEORGIA_LON_RANGE = (-85.6, -81.0)
 
 def is_in_georgia(lat: float, lon: float):
     """Checks if a given latitude and longitude are within the state of Georgia."""
-    return 30.3 <= lat <= 35.0 and -85.6 <= lon <= -81.0
+    return (GEORGIA_LAT_RANGE[0] <= lat <= GEORGIA_LAT_RANGE[1]
+            and GEORGIA_LON_RANGE[0] <= lon <= GEORGIA_LON_RANGE[1])
 
-def get_map_overview(db: Session):
-    systems = db.query(
+def get_dataset_version(db: Session):
+    version = db.query(models.DatasetVersion.version).filter(models.DatasetVersion.id == 1).scalar()
+    return version or 0
+
+def get_autocomplete_rows(db: Session):
+    return db.query(
         models.PublicWaterSystem.pwsid,
         models.PublicWaterSystem.pws_name,
-        models.GeographicArea.geom
-    ).join(models.GeographicArea, models.PublicWaterSystem.pwsid == models.GeographicArea.pwsid).all()
-
-    systems_with_status = []
-    for system in systems:
-        status = get_water_system_status(db, system.pwsid)
-        systems_with_status.append({
-            "pwsid": system.pwsid,
-            "pws_name": system.pws_name,
-            "geom": system.geom,
-            "status": status
-        })
-    return systems_with_status
-
-def get_system_history(db: Session, pwsid: str):
-    violations = db.query(models.Violation).filter(models.Violation.pwsid == pwsid).all()
-    site_visits = db.query(models.SiteVisit).filter(models.SiteVisit.pwsid == pwsid).all()
-    lcr_samples = db.query(models.LcrSample).filter(models.LcrSample.pwsid == pwsid).all()
-    events_milestones = db.query(models.EventMilestone).filter(models.EventMilestone.pwsid == pwsid).all()
+        models.PublicWaterSystem.city_name,
+        models.PublicWaterSystem.zip_code,
+        models.PublicWaterSystem.population_served_count
+    ).all()
 
-    return {
-        "violations": violations,
-        "site_visits": site_visits,
-        "lcr_samples": lcr_samples,
-        "events_milestones": events_milestones,
-    }
+def get_geographic_points(db: Session):
+    """Returns (pwsid, lat, lon) for every geocoded geographic area."""
+    return db.query(
+        models.GeographicArea.pwsid,
+        func.ST_Y(models.GeographicArea.geom),
+        func.ST_X(models.GeographicArea.geom)
+    ).filter(models.GeographicArea.geom != None).all()
+
+def get_map_overview(db: Session):
+    """Returns every geocoded system as a dict shaped like schemas.MapOverview, built in the query."""
+    systems = db.execute(
+        select(
+            models.PublicWaterSystem.pwsid,
+            models.PublicWaterSystem.pws_name,
+            func.ST_AsText(models.GeographicArea.geom).label("geom"),
+            status_column(models.PublicWaterSystem.pwsid).label("status")
+        ).join(
+            models.GeographicArea, models.PublicWaterSystem.pwsid == models.GeographicArea.pwsid
+        ).outerjoin(
+            models.SystemStatus, models.PublicWaterSystem.pwsid == models.SystemStatus.pwsid
+        ).where(models.GeographicArea.geom != None)
+    ).mappings()
+    return [dict(system) for system in systems]
+
+# Each history section is keyset-paginated on its primary key within the system,
+# projects only the fields its schema exposes and is filtered by date on the
+# given column.
+HISTORY_SECTIONS = {
+    "violations": (
+        models.Violation, schemas.Violation, [models.Violation.violation_id],
+        models.Violation.non_compl_per_begin_date
+    ),
+    "site_visits": (models.SiteVisit, schemas.SiteVisit, [models.SiteVisit.visit_id], models.SiteVisit.visit_date),
+    "lcr_samples": (
+        models.LcrSample, schemas.LcrSample, [models.LcrSample.sample_id, models.LcrSample.sar_id],
+        models.LcrSample.sampling_end_date
+    ),
+    "events_milestones": (
+        models.EventMilestone, schemas.EventMilestone, [models.EventMilestone.event_schedule_id],
+        models.EventMilestone.event_actual_date
+    ),
+}
+
+def history_pages(limit: int, cursor: str = None, section_limits: dict = None):
+    """Returns (cursor position per section, sections still to read, row limit per section)."""
+    after = pagination.decode_cursor(cursor) if cursor else {}
+    if not isinstance(after, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # On later pages, sections exhausted earlier carry no position and are skipped.
+    sections = [section for section in HISTORY_SECTIONS if not cursor or after.get(section) is not None]
+    limits = {section: (section_limits or {}).get(section) or limit for section in HISTORY_SECTIONS}
+    return after, sections, limits
+
+def system_history_statement(pwsid: str, sections: list, limits: dict, after: dict,
+                             start_date: date = None, end_date: date = None):
+    """Selects one row holding, per section, a JSON array of up to limit + 1 projected rows."""
+    pages = []
+    for section in sections:
+        model, schema, key_columns, date_column = HISTORY_SECTIONS[section]
+        statement = select(*[getattr(model, field) for field in schema.__fields__]).where(model.pwsid == pwsid)
+        if start_date is not None:
+            statement = statement.where(date_column >= start_date)
+        if end_date is not None:
+            statement = statement.where(date_column <= end_date)
+        order_by = [(column, False) for column in key_columns]
+        pages.append(pagination.json_page(statement, order_by, limits[section], after.get(section)).label(section))
+    return select(*pages)
+
+def system_history_from_row(row, sections: list, limits: dict):
+    history, next_keys = {}, {}
+    for section, (_, _, key_columns, _) in HISTORY_SECTIONS.items():
+        if section not in sections:
+            history[section], next_keys[section] = [], None
+            continue
+        history[section], next_keys[section] = pagination.json_page_items(
+            row._mapping[section], [(column, False) for column in key_columns], limits[section]
+        )
+    history["next_cursor"] = pagination.encode_cursor(next_keys) if any(next_keys.values()) else None
+    return history
+
+def get_system_history(db: Session, pwsid: str, limit: int = 500, cursor: str = None,
+                       start_date: date = None, end_date: date = None, section_limits: dict = None):
+    """Returns up to `limit` rows per section plus a cursor resuming every unfinished section.
+
+    `section_limits` overrides `limit` per section. All sections are read
+    in one statement, as the JSON the API returns.
+    """
+    after, sections, limits = history_pages(limit, cursor, section_limits)
+    if not sections:
+        return system_history_from_row(None, sections, limits)
+    row = db.execute(system_history_statement(pwsid, sections, limits, after, start_date, end_date)).one()
+    return system_history_from_row(row, sections, limits)
 
 def acknowledge_violation(db: Session, violation_id: str):
     db_violation = db.query(models.Violation).filter(models.Violation.violation_id == violation_id).first()
@@ -125,6 +355,8 @@ def acknowledge_violation(db: Session, violation_id: str):
         raise HTTPException(status_code=404, detail="Violation not found")
 
     db_violation.violation_status = "Acknowledged"
+    refresh_system_status(db, db_violation.pwsid)
+    # The new refreshed_at moves the system's cached responses to fresh keys.
     db.commit()
     db.refresh(db_violation)
     return db_violation
@@ -1,17 +1,122 @@
-from sqlalchemy import create_engine
+import os
+import time
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+import metrics
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db/water_data")
+# Read-only routes use the replica when one is configured.
+SQLALCHEMY_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or SQLALCHEMY_DATABASE_URL
+
+# Per engine and per API worker process; size them so that
+# workers * engines * (POOL_SIZE + MAX_OVERFLOW) stays under max_connections.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds before a connection is replaced; -1 keeps connections forever.
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Server-side limit per statement in milliseconds; 0 disables it.
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Table exports hold a connection for the whole download, so they get their
+# own pool of this many connections and can't starve the request pools.
+EXPORT_POOL_SIZE = int(os.getenv("DB_EXPORT_POOL_SIZE", "2"))
+
+
+class _InstrumentedPool:
+    """Records how long each checkout waited for a free connection."""
+
+    metrics_name = "db_pool"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.increment(f"{self.metrics_name}_checkout_timeouts")
+            raise
+        finally:
+            metrics.observe(f"{self.metrics_name}_checkout_wait", time.perf_counter() - started)
+
+def _instrumented(pool_class, name):
+    return type(f"Instrumented{pool_class.__name__}", (_InstrumentedPool, pool_class), {"metrics_name": f"db_{name}_pool"})
+
+def _pool_status(pool, capacity):
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "saturation": checked_out / capacity,
+    }
+
+def _pool_options(pool_class, name, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW):
+    return {
+        "poolclass": _instrumented(pool_class, name),
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+def _create_engine(url, name, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW):
+    connect_args = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"} if STATEMENT_TIMEOUT_MS else {}
+    engine = create_engine(url, connect_args=connect_args, **_pool_options(QueuePool, name, pool_size, max_overflow))
+    metrics.register_gauge(f"db_{name}_pool", lambda: _pool_status(engine.pool, pool_size + max_overflow))
+    return engine
 
-SQLALCHEMY_DATABASE_URL = "postgresql://user:password@db/water_data"
+def _create_async_engine(url, name):
+    connect_args = {"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}} if STATEMENT_TIMEOUT_MS else {}
+    engine = create_async_engine(
+        url.replace("postgresql://", "postgresql+asyncpg://", 1),
+        connect_args=connect_args,
+        **_pool_options(AsyncAdaptedQueuePool, name)
+    )
+    metrics.register_gauge(f"db_{name}_pool", lambda: _pool_status(engine.sync_engine.pool, POOL_SIZE + MAX_OVERFLOW))
+    return engine
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+_has_replica = SQLALCHEMY_REPLICA_URL != SQLALCHEMY_DATABASE_URL
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL, "primary")
+read_engine = _create_engine(SQLALCHEMY_REPLICA_URL, "replica") if _has_replica else engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+export_engine = _create_engine(SQLALCHEMY_REPLICA_URL, "export", pool_size=EXPORT_POOL_SIZE, max_overflow=0)
+
+# Used by the async read routes so they don't occupy a threadpool worker per request.
+async_engine = _create_async_engine(SQLALCHEMY_DATABASE_URL, "primary_async")
+async_read_engine = _create_async_engine(SQLALCHEMY_REPLICA_URL, "replica_async") if _has_replica else async_engine
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = sessionmaker(bind=async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
 def get_db():
+    """Session on the primary, for writes and reads that must see them."""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db():
+    """Session on the replica (or the primary when none is configured), for read-only routes."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from geoalchemy2 import Geometry
+from psycopg2 import sql
+from sqlalchemy import exc
+
+import database
+import models
+
+# Rows fetched per round trip from the server-side cursor; bounds memory per export.
+FETCH_SIZE = 2000
+
+EXPORTABLE_MODELS = {
+    model.__tablename__: model
+    for model in (
+        models.PublicWaterSystem,
+        models.GeographicArea,
+        models.Facility,
+        models.Violation,
+        models.LcrSample,
+        models.RefCodeValue,
+        models.EventMilestone,
+        models.PnViolationAssoc,
+        models.ServiceArea,
+        models.SiteVisit,
+    )
+}
+
+def _select_statement(model):
+    columns = [
+        sql.SQL("ST_AsText({0}) AS {0}").format(sql.Identifier(column.name))
+        if isinstance(column.type, Geometry) else sql.Identifier(column.name)
+        for column in model.__table__.columns
+    ]
+    return sql.SQL("SELECT {} FROM {}").format(sql.SQL(", ").join(columns), sql.Identifier(model.__tablename__))
+
+def _connect():
+    """Checks out an export connection before the response starts, so a busy pool is a 503 rather than a cut-off download."""
+    try:
+        return database.export_engine.raw_connection()
+    except exc.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many exports in progress, try again shortly.",
+            headers={"Retry-After": "5"},
+        )
+
+def _batches(model, connection):
+    """Yields lists of row tuples from a named (server-side) psycopg2 cursor, then returns `connection` to its pool."""
+    try:
+        with connection.cursor(name=f"export_{model.__tablename__}") as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(_select_statement(model))
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        connection.close()
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _ndjson(model, connection):
+    names = [column.name for column in model.__table__.columns]
+    for rows in _batches(model, connection):
+        yield "".join(json.dumps(dict(zip(names, row)), default=_json_default) + "\n" for row in rows)
+
+def _csv(model, connection):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in model.__table__.columns])
+    for rows in _batches(model, connection):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header alone still has to go out for an empty table.
+    if buffer.tell():
+        yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    "ndjson": (_ndjson, "application/x-ndjson"),
+    "csv": (_csv, "text/csv"),
+}
+
+def export_table(table: str, format: str):
+    model = EXPORTABLE_MODELS.get(table)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"Unknown table: {table}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    generate, media_type = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        generate(model, _connect()),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
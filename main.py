@@ -1,17 +1,65 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Union
-from datetime import datetime, timedelta
+from typing import List, Optional, Union
+from datetime import date, datetime, timedelta
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
+import asyncio
+import logging
+import os
+
+import async_crud
+import auth_cache
+import autocomplete
+import cache
 import crud
+import export
+import metrics
 import models
+import pagination
+import passwords
 import schemas
 import database
+import spatial_index
+import tiles
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # optional; gzip only
+    BrotliMiddleware = None
 
+# The search indexes on sdwa_pub_water_systems use pg_trgm operator classes.
+with database.engine.begin() as conn:
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
 database.Base.metadata.create_all(bind=database.engine)
+# violation_status used to be varchar(11), too short for "Acknowledged"; widening is catalog-only.
+with database.engine.begin() as conn:
+    conn.execute(text("""
+        DO $$ BEGIN
+            IF (SELECT character_maximum_length FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = 'sdwa_violations_enforcement'
+                  AND column_name = 'violation_status') < 20 THEN
+                ALTER TABLE sdwa_violations_enforcement ALTER COLUMN violation_status TYPE varchar(20);
+            END IF;
+        END $$;
+    """))
+# Databases built from the old schema.sql have no key on sdwa_service_areas;
+# the delta ingest's upserts conflict on it, and full reloads copy the live one.
+with database.engine.begin() as conn:
+    conn.execute(text("""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                           WHERE conrelid = 'sdwa_service_areas'::regclass AND contype = 'p') THEN
+                ALTER TABLE sdwa_service_areas ADD PRIMARY KEY (pwsid, service_area_type_code);
+            END IF;
+        END $$;
+    """))
 
 app = FastAPI(
     title="Water Quality Data API",
@@ -25,14 +73,59 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.CURSOR_HEADER],
 )
 
+# Responses smaller than this are sent uncompressed; the CPU isn't worth it.
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000"))
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
 SECRET_KEY = "a_very_secret_key"  # In a real app, use a more secure key and load from env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+logger = logging.getLogger(__name__)
+
+def in_memory_snapshots():
+    snapshots = [autocomplete.snapshot]
+    if spatial_index.ENABLED:
+        snapshots.append(spatial_index.snapshot)
+    return snapshots
+
+@app.on_event("startup")
+def build_in_memory_indexes():
+    db = database.ReadSessionLocal()
+    try:
+        for snapshot in in_memory_snapshots():
+            try:
+                snapshot.rebuild(db)
+            except Exception:
+                logger.exception("Could not build the %s at startup", snapshot.name)
+    finally:
+        db.close()
+
+def refresh_in_memory_indexes(version: int):
+    """Rebuilds the snapshots older than dataset `version`; requests keep the old ones meanwhile."""
+    stale = [snapshot for snapshot in in_memory_snapshots() if snapshot.version != version]
+    if not stale:
+        return
+    with database.ReadSessionLocal() as db:
+        for snapshot in stale:
+            snapshot.refresh(db, version)
+
+@app.on_event("startup")
+async def start_cache_version_polling():
+    # The version poll also drives the snapshot rebuilds, on a worker thread.
+    asyncio.create_task(cache.poll_dataset_version(
+        database.AsyncReadSessionLocal, async_crud.get_dataset_state,
+        on_version=lambda version: run_in_threadpool(refresh_in_memory_indexes, version)
+    ))
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -43,7 +136,12 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
+    # A token verified recently needs neither the signature check nor the user lookup again.
+    user = auth_cache.principals.get(token)
+    if user is not None:
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -57,81 +155,189 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
+    user = await async_crud.get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    auth_cache.principals.set(token, user, payload.get("exp"))
     return user
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     return current_user
 
-# Dependency
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @app.get("/")
 def read_root():
     """A simple endpoint to confirm the API is running."""
     return {"message": "Welcome to the Water Quality Data API!"}
 
 @app.get("/systems/by-id/{pwsid}", response_model=schemas.PublicWaterSystem)
-def read_pws_by_id(pwsid: str, db: Session = Depends(get_db)):
-    db_pws = crud.get_pws_by_id(db, pwsid=pwsid)
-    if db_pws is None:
-        raise HTTPException(status_code=404, detail="Public Water System not found")
-    return db_pws
-
-@app.get("/systems/by-name/{name}", response_model=List[schemas.PublicWaterSystem])
-def read_pws_by_name(name: str, db: Session = Depends(get_db)):
-    db_pws = crud.get_pws_by_name(db, name=name)
-    return db_pws
-
-@app.get("/systems/by-zip/{zip_code}", response_model=List[schemas.PublicWaterSystem])
-def read_pws_by_zip(zip_code: str, db: Session = Depends(get_db)):
-    db_pws = crud.get_pws_by_zip(db, zip_code=zip_code)
-    return db_pws
-
-@app.get("/violations/{pwsid}", response_model=List[schemas.Violation])
-def read_violations_by_pwsid(pwsid: str, db: Session = Depends(get_db)):
-    db_violations = crud.get_violations_by_pwsid(db, pwsid=pwsid)
-    return db_violations
-
-@app.get("/systems/search", response_model=List[schemas.PublicWaterSystem])
-def search_systems(query: str, db: Session = Depends(get_db)):
-    return crud.search_systems(db, query=query)
+async def read_pws_by_id(pwsid: str, request: Request, db: AsyncSession = Depends(database.get_async_read_db)):
+    async def fetch():
+        db_pws = await async_crud.get_pws_by_id(db, pwsid=pwsid)
+        if db_pws is None:
+            raise HTTPException(status_code=404, detail="Public Water System not found")
+        return db_pws
+    return await cache.cached_json(
+        "pws_by_id", fetch, schema=schemas.PublicWaterSystem, request=request,
+        changed_at=lambda: async_crud.get_system_changed_at(db, pwsid), pwsid=pwsid
+    )
+
+def paged(response: Response, page: pagination.Page):
+    """Returns the page items and exposes the keyset cursor for the next page as a header."""
+    if page.next_cursor:
+        response.headers[pagination.CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+@app.get("/systems/by-name/{name}", response_model=List[schemas.PublicWaterSystem], response_model_exclude_unset=True)
+def read_pws_by_name(
+    name: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    columns = pagination.parse_fields(fields, schemas.PublicWaterSystem, ["pwsid"])
+    return paged(response, crud.get_pws_by_name(db, name=name, limit=limit, cursor=cursor, fields=columns))
+
+@app.get("/systems/by-zip/{zip_code}", response_model=List[schemas.PublicWaterSystem], response_model_exclude_unset=True)
+def read_pws_by_zip(
+    zip_code: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    columns = pagination.parse_fields(fields, schemas.PublicWaterSystem, ["pwsid"])
+    return paged(response, crud.get_pws_by_zip(db, zip_code=zip_code, limit=limit, cursor=cursor, fields=columns))
+
+@app.get("/violations/{pwsid}", response_model=List[schemas.Violation], response_model_exclude_unset=True)
+def read_violations_by_pwsid(
+    pwsid: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db)
+):
+    columns = pagination.parse_fields(fields, schemas.Violation, ["violation_id", "pwsid"])
+    return paged(response, crud.get_violations_by_pwsid(db, pwsid=pwsid, limit=limit, cursor=cursor, fields=columns))
+
+@app.get("/systems/search", response_model=List[schemas.PublicWaterSystem], response_model_exclude_unset=True)
+async def search_systems(
+    query: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    columns = pagination.parse_fields(fields, schemas.PublicWaterSystem, ["pwsid"])
+    return paged(response, await async_crud.search_systems(db, query=query, limit=limit, cursor=cursor, fields=columns))
+
+@app.post("/systems/batch", response_model=schemas.BatchLookupResponse)
+async def read_systems_batch(batch: schemas.BatchLookupRequest, db: AsyncSession = Depends(database.get_async_read_db)):
+    """Resolves many pwsids and points at once, with a fixed number of queries per request."""
+    return await async_crud.get_systems_batch(
+        db, pwsids=batch.pwsids, points=[(point.lat, point.lon) for point in batch.points]
+    )
+
+@app.get("/systems/autocomplete", response_model=List[schemas.AutocompleteEntry])
+def autocomplete_systems(
+    q: str,
+    limit: int = Query(10, ge=1, le=autocomplete.MAX_LIMIT),
+    db: Session = Depends(database.get_read_db)
+):
+    index = autocomplete.snapshot.get(db)
+    if index is None:
+        raise HTTPException(status_code=503, detail="Autocomplete index is not available yet.")
+    return index.lookup(q, limit=limit)
 
 @app.get("/systems/{pwsid}/status", response_model=str)
-def read_system_status(pwsid: str, db: Session = Depends(get_db)):
-    return crud.get_water_system_status(db, pwsid=pwsid)
+async def read_system_status(pwsid: str, request: Request, db: AsyncSession = Depends(database.get_async_read_db)):
+    return await cache.cached_json(
+        "system_status", lambda: async_crud.get_water_system_status(db, pwsid=pwsid), request=request,
+        changed_at=lambda: async_crud.get_system_changed_at(db, pwsid), pwsid=pwsid
+    )
 
 @app.get("/statistics", response_model=dict)
-def read_statistics(db: Session = Depends(get_db)):
-    return crud.get_system_statistics(db)
+async def read_statistics(
+    request: Request,
+    county: Optional[str] = None,
+    pws_type_code: Optional[str] = None,
+    gw_sw_code: Optional[str] = None,
+    contaminant: Optional[str] = None,
+    quarter: Optional[str] = Query(None, description="e.g. 2024Q3"),
+    breakdown: Optional[str] = Query(None, description=", ".join(async_crud.STATISTICS_DIMENSIONS)),
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    """Statewide system counts; pass one dimension as a filter, or `breakdown` to list every value of one."""
+    filters = {
+        "county": county,
+        "pws_type_code": pws_type_code,
+        "gw_sw_code": gw_sw_code,
+        "contaminant": contaminant,
+        "quarter": quarter,
+    }
+    return await cache.cached_json(
+        "statistics",
+        lambda: async_crud.get_system_statistics(db, filters=filters, breakdown=breakdown),
+        request=request,
+        breakdown=breakdown,
+        **filters
+    )
 
 @app.get("/systems/by-location", response_model=schemas.PublicWaterSystem)
-def read_system_by_location(lat: float, lon: float, db: Session = Depends(get_db)):
+def read_system_by_location(lat: float, lon: float, db: Session = Depends(database.get_read_db)):
     if not crud.is_in_georgia(lat, lon):
         raise HTTPException(status_code=404, detail="Location is outside of Georgia.")
-    nearest_system = crud.get_nearest_system(db, lat=lat, lon=lon)
-    if not nearest_system:
-        raise HTTPException(status_code=404, detail="No water system found near this location.")
-    return crud.get_pws_by_id(db, pwsid=nearest_system.pwsid)
+    nearest_pwsid = spatial_index.nearest_pwsid(db, lat=lat, lon=lon)
+    if nearest_pwsid is None:
+        nearest_system = crud.get_nearest_system(db, lat=lat, lon=lon)
+        if not nearest_system:
+            raise HTTPException(status_code=404, detail="No water system found near this location.")
+        nearest_pwsid = nearest_system.pwsid
+    return crud.get_pws_by_id(db, pwsid=nearest_pwsid)
+
+@app.get("/systems/nearby", response_model=List[schemas.PublicWaterSystem])
+async def read_systems_nearby(
+    lat: float,
+    lon: float,
+    limit: int = Query(5, ge=1, le=50),
+    max_distance_m: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    if not crud.is_in_georgia(lat, lon):
+        raise HTTPException(status_code=404, detail="Location is outside of Georgia.")
+    pwsids = await async_crud.get_nearest_pwsids(db, lat=lat, lon=lon, limit=limit, max_distance_m=max_distance_m)
+    return await async_crud.get_pws_by_ids(db, pwsids=pwsids)
+
+@app.get("/metrics")
+def read_metrics():
+    """Per-process counters, timings (e.g. connection pool checkout waits) and pool saturation."""
+    return metrics.snapshot()
+
+@app.get("/export/{table}")
+def export_table(table: str, format: str = "ndjson", current_user: models.User = Depends(get_current_user)):
+    """Streams a whole `sdwa_*` table as NDJSON or CSV without buffering it in memory."""
+    return export.export_table(table, format)
 
 @app.post("/auth/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
+    db_user = await async_crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    # Hand the connection back while the password is hashed; the insert checks out a fresh one.
+    await db.close()
+    return await async_crud.create_user(db=db, user=user)
 
 @app.post("/auth/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not crud.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    user = await async_crud.get_user_by_username(db, username=form_data.username)
+    # Hand the connection back before the slow hash so a login storm can't drain the pool
+    # the data routes share; the loaded user stays usable once detached.
+    await db.close()
+    if not user or not await passwords.verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -148,15 +354,90 @@ async def read_users_me(current_user: models.User = Depends(get_current_active_u
     return current_user
 
 @app.get("/api/systems/map_overview", response_model=List[schemas.MapOverview])
-def get_map_overview(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.get_map_overview(db)
+async def get_map_overview(
+    request: Request,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return await cache.cached_json(
+        "map_overview",
+        lambda: run_in_threadpool(crud.get_map_overview, db),
+        schema=List[schemas.MapOverview],
+        request=request,
+        fast=True
+    )
+
+@app.get("/tiles/{z}/{x}/{y}.mvt")
+async def read_map_tile(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Mapbox vector tile of the systems in one web-mercator tile, so the map only loads its viewport."""
+    tiles.check_tile(z, x, y)
+    return await cache.cached_response(
+        "map_tile", lambda: tiles.get_tile(db, z, x, y), bytes, tiles.MVT_MEDIA_TYPE, request, z=z, x=x, y=y
+    )
+
+@app.get("/tiles/{z}/{x}/{y}.geojson")
+async def read_map_tile_clusters(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Server-side clustered GeoJSON for one tile, for low zoom levels where points would overlap."""
+    tiles.check_tile(z, x, y)
+    return await cache.cached_json(
+        "map_tile_clusters", lambda: tiles.get_tile_clusters(db, z, x, y), request=request, fast=True, z=z, x=x, y=y
+    )
 
 @app.get("/api/systems/{pwsid}/history", response_model=schemas.SystemHistory)
-def get_system_history(pwsid: str, db: Session = Depends(get_db)):
-    return crud.get_system_history(db, pwsid=pwsid)
+async def get_system_history(
+    pwsid: str,
+    request: Request,
+    limit: int = Query(500, ge=1, le=5000),
+    cursor: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    violations_limit: Optional[int] = Query(None, ge=1, le=5000),
+    site_visits_limit: Optional[int] = Query(None, ge=1, le=5000),
+    lcr_samples_limit: Optional[int] = Query(None, ge=1, le=5000),
+    events_milestones_limit: Optional[int] = Query(None, ge=1, le=5000),
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    section_limits = {
+        "violations": violations_limit,
+        "site_visits": site_visits_limit,
+        "lcr_samples": lcr_samples_limit,
+        "events_milestones": events_milestones_limit,
+    }
+    # The rows come back from the database already shaped like schemas.SystemHistory,
+    # so they are stored without another validation pass.
+    return await cache.cached_json(
+        "system_history",
+        lambda: async_crud.get_system_history(
+            db, pwsid, limit=limit, cursor=cursor, start_date=start_date, end_date=end_date,
+            section_limits=section_limits
+        ),
+        request=request,
+        changed_at=lambda: async_crud.get_system_changed_at(db, pwsid),
+        fast=True,
+        pwsid=pwsid,
+        limit=limit,
+        cursor=cursor,
+        start_date=start_date,
+        end_date=end_date,
+        **{f"{section}_limit": value for section, value in section_limits.items()}
+    )
 
 @app.put("/api/violations/{violation_id}/acknowledge", response_model=schemas.Violation)
-def acknowledge_violation(violation_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def acknowledge_violation(violation_id: str, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "Operator":
         raise HTTPException(status_code=403, detail="Only operators can acknowledge violations.")
     return crud.acknowledge_violation(db, violation_id=violation_id)
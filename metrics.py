@@ -0,0 +1,39 @@
+import threading
+from collections import defaultdict
+
+# In-process metrics, served as JSON by the /metrics route. Each API worker
+# process reports its own numbers.
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+_gauges = {}
+
+
+def increment(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+def observe(name: str, seconds: float):
+    """Records one duration; reported as count, total and max."""
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+def register_gauge(name: str, read):
+    """Registers a callable returning the current value (or a dict of values) of `name`."""
+    with _lock:
+        _gauges[name] = read
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        timings = {name: dict(timing) for name, timing in _timings.items()}
+        gauges = dict(_gauges)
+    return {
+        "counters": counters,
+        "timings": timings,
+        "gauges": {name: read() for name, read in gauges.items()},
+    }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, BigInteger, Numeric, DateTime, func
+from sqlalchemy import Column, Integer, String, Date, BigInteger, Numeric, DateTime, Index, func, text
 from geoalchemy2 import Geometry
 import database
 
@@ -13,6 +13,21 @@ class User(database.Base):
 
 class PublicWaterSystem(database.Base):
     __tablename__ = "sdwa_pub_water_systems"
+    __table_args__ = (
+        # Search: trigram GIN for substring/similarity matches on name and pwsid
+        # (needs pg_trgm), and a pattern-ops btree for anchored pwsid prefixes.
+        Index(
+            "idx_sdwa_pub_water_systems_name_trgm", "pws_name",
+            postgresql_using="gin", postgresql_ops={"pws_name": "gin_trgm_ops"}
+        ),
+        Index(
+            "idx_sdwa_pub_water_systems_pwsid_trgm", "pwsid",
+            postgresql_using="gin", postgresql_ops={"pwsid": "gin_trgm_ops"}
+        ),
+        Index("idx_sdwa_pub_water_systems_pwsid_prefix", "pwsid", postgresql_ops={"pwsid": "varchar_pattern_ops"}),
+        # Zip lookups, keyset-paginated on pwsid.
+        Index("idx_sdwa_pub_water_systems_zip_code", "zip_code", "pwsid"),
+    )
 
     submissionyearquarter = Column(String(7))
     pwsid = Column(String(9), primary_key=True, index=True)
@@ -66,6 +81,34 @@ class PublicWaterSystem(database.Base):
     reduced_monitoring_end_date = Column(Date)
     seasonal_startup_system = Column(String(40))
 
+class DatasetVersion(database.Base):
+    """Single-row counter bumped by every ingest run; in-process indexes rebuild when it changes."""
+    __tablename__ = "dataset_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class SystemStatus(database.Base):
+    """Precomputed safe/not-safe verdict per system, rebuilt on ingest."""
+    __tablename__ = "system_status"
+
+    pwsid = Column(String(9), primary_key=True)
+    active_violation_count = Column(Integer, nullable=False, default=0)
+    last_violation_date = Column(Date)
+    status = Column(String(10), nullable=False)
+    refreshed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class StatisticsRollup(database.Base):
+    """System counts per dimension value ('all' holds the statewide totals), rebuilt on ingest."""
+    __tablename__ = "statistics_rollup"
+
+    dimension = Column(String(20), primary_key=True)
+    value = Column(String(40), primary_key=True)
+    total_systems = Column(Integer, nullable=False, default=0)
+    total_systems_with_violations = Column(Integer, nullable=False, default=0)
+    active_systems_with_violations = Column(Integer, nullable=False, default=0)
+
 class GeographicArea(database.Base):
     __tablename__ = "sdwa_geographic_areas"
 
@@ -80,7 +123,7 @@ class GeographicArea(database.Base):
     city_served = Column(String(40))
     county_served = Column(String(40))
     last_reported_date = Column(Date)
-    geom = Column(Geometry('POINT'))
+    geom = Column(Geometry('POINT', srid=4326, spatial_index=True))
 
 class Facility(database.Base):
     __tablename__ = "sdwa_facilities"
@@ -110,6 +153,16 @@ from sqlalchemy.orm import relationship
 
 class Violation(database.Base):
     __tablename__ = "sdwa_violations_enforcement"
+    __table_args__ = (
+        # Per-system lookups, keyset-paginated on violation_id. The child tables
+        # below get the same access path from primary keys that lead with pwsid.
+        Index("idx_sdwa_violations_enforcement_pwsid", "pwsid", "violation_id"),
+        # Matches crud.active_health_based_filter(), the status and statistics predicate.
+        Index(
+            "idx_sdwa_violations_enforcement_active_health_based", "pwsid",
+            postgresql_where=text("is_health_based_ind = 'Y' AND non_compl_per_end_date IS NULL")
+        ),
+    )
 
     submissionyearquarter = Column(String(7))
     pwsid = Column(String(9), ForeignKey("sdwa_pub_water_systems.pwsid"))
@@ -128,7 +181,7 @@ class Violation(database.Base):
     is_major_viol_ind = Column(String(1))
     severity_ind_cnt = Column(String(255))
     calculated_rtc_date = Column(Date)
-    violation_status = Column(String(11))
+    violation_status = Column(String(20))
     public_notification_tier = Column(Integer)
     calculated_pub_notif_tier = Column(Integer)
     viol_originator_code = Column(String(10))
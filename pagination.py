@@ -0,0 +1,121 @@
+import base64
+import json
+from collections import namedtuple
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects.postgresql import JSON, aggregate_order_by
+
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values):
+    if values is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str], schema, key_fields):
+    """Turns a `fields=a,b` query parameter into a column list, always keeping the sort keys."""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(requested) - set(schema.__fields__))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys([*key_fields, *requested]))
+
+def _after(order_by, values):
+    """Rows strictly after `values` in the (expression, descending) ordering."""
+    clauses = []
+    for i, (expression, descending) in enumerate(order_by):
+        step = expression < values[i] if descending else expression > values[i]
+        clauses.append(and_(*[order_by[j][0] == values[j] for j in range(i)], step))
+    return or_(*clauses)
+
+def _keyset(query, order_by, limit: int, after=None):
+    """Applies the cursor, sort keys, ordering and limit to a Query or a select().
+
+    Returns the limited query, the labelled sort keys and whether it selects
+    a single ORM entity.
+    """
+    if after is not None:
+        if not isinstance(after, list) or len(after) != len(order_by):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(_after(order_by, after))
+
+    descriptions = query.column_descriptions
+    entity_query = len(descriptions) == 1 and descriptions[0]["expr"] is descriptions[0]["entity"]
+    keys = [expression.label(f"cursor_{i}") for i, (expression, _) in enumerate(order_by)]
+    query = query.add_columns(*keys).order_by(
+        *[expression.desc() if descending else expression for expression, descending in order_by]
+    ).limit(limit + 1)
+    return query, keys, entity_query
+
+def _page(rows, keys, limit: int, entity_query: bool):
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = [rows[-1]._mapping[key.name] for key in keys]
+    if entity_query:
+        items = [row[0] for row in rows]
+    else:
+        items = [
+            {name: value for name, value in row._mapping.items() if not name.startswith("cursor_")}
+            for row in rows
+        ]
+    return items, next_key
+
+def paginate(query, order_by, limit: int, after=None):
+    """Keyset-paginates `query` and returns (items, key of the last item or None).
+
+    `order_by` is a list of (expression, descending) pairs whose last entry
+    must be unique. The sort keys are selected alongside the rows, so
+    computed keys such as similarity() can be resumed from too. Entity
+    queries yield ORM objects; column projections yield dicts.
+    """
+    query, keys, entity_query = _keyset(query, order_by, limit, after)
+    return _page(query.all(), keys, limit, entity_query)
+
+def json_page(statement, order_by, limit: int, after=None):
+    """A scalar subquery aggregating one keyset page of the select() `statement` into a JSON array.
+
+    Several pages can then be fetched in a single statement; split each
+    result with `json_page_items`.
+    """
+    statement, keys, _ = _keyset(statement, order_by, limit, after)
+    page = statement.subquery()
+    ordering = [page.c[key.name].desc() if descending else page.c[key.name]
+                for key, (_, descending) in zip(keys, order_by)]
+    return select(func.json_agg(aggregate_order_by(page.table_valued(), *ordering), type_=JSON)).scalar_subquery()
+
+def json_page_items(rows, order_by, limit: int):
+    """Splits the array read from a `json_page` into (items, key of the last item or None)."""
+    rows = rows or []
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = [rows[-1][f"cursor_{i}"] for i in range(len(order_by))]
+    items = [{name: value for name, value in row.items() if not name.startswith("cursor_")} for row in rows]
+    return items, next_key
+
+async def paginate_async(db, statement, order_by, limit: int, after=None):
+    """`paginate` for a select() executed on an AsyncSession."""
+    statement, keys, entity_query = _keyset(statement, order_by, limit, after)
+    return _page((await db.execute(statement)).all(), keys, limit, entity_query)
+
+def paginate_with_cursor(query, order_by, limit: int, cursor: Optional[str] = None):
+    items, next_key = paginate(query, order_by, limit, decode_cursor(cursor) if cursor else None)
+    return Page(items, encode_cursor(next_key))
+
+async def paginate_with_cursor_async(db, statement, order_by, limit: int, cursor: Optional[str] = None):
+    items, next_key = await paginate_async(db, statement, order_by, limit, decode_cursor(cursor) if cursor else None)
+    return Page(items, encode_cursor(next_key))
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+import crud
+import metrics
+
+# bcrypt costs ~100ms of CPU per call and releases the GIL while it runs, so a
+# few threads hash in parallel without stalling the event loop.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Calls running or waiting beyond this are refused with a 503 rather than
+# queued behind a login storm.
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_lock = threading.Lock()
+_in_flight = 0
+
+
+def _pool_status():
+    return {"workers": PASSWORD_HASH_WORKERS, "in_flight": _in_flight, "queue_limit": PASSWORD_HASH_QUEUE_LIMIT}
+
+metrics.register_gauge("password_hash_pool", _pool_status)
+
+async def _run(function, *args):
+    global _in_flight
+    with _lock:
+        if _in_flight >= PASSWORD_HASH_QUEUE_LIMIT:
+            metrics.increment("password_hash_rejected")
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sign-ins in progress, try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+        _in_flight += 1
+
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+    finally:
+        with _lock:
+            _in_flight -= 1
+        metrics.observe("password_hash", time.perf_counter() - started)
+
+async def verify_password(plain_password, hashed_password):
+    """`crud.verify_password` on the bounded hashing pool."""
+    return await _run(crud.verify_password, plain_password, hashed_password)
+
+async def get_password_hash(password):
+    """`crud.get_password_hash` on the bounded hashing pool."""
+    return await _run(crud.get_password_hash, password)
@@ -0,0 +1,51 @@
+# The rows of statistics_rollup: system counts statewide ('all') and per
+# county, type, source, contaminant and quarter. scripts/ingest_data.py
+# materializes them on ingest; async_crud counts from the same query before
+# the first one. For contaminant and quarter, total_systems counts systems with
+# any violation in that slice.
+STATISTICS_ROLLUP_SQL = """
+    WITH violations AS (
+        SELECT pwsid,
+               contaminant_code,
+               to_char(non_compl_per_begin_date, 'YYYY"Q"Q') AS quarter,
+               is_health_based_ind = 'Y' AS health_based,
+               is_health_based_ind = 'Y' AND non_compl_per_end_date IS NULL AS active
+        FROM sdwa_violations_enforcement
+    ),
+    systems AS (
+        SELECT p.pwsid, p.pws_type_code, p.gw_sw_code,
+               COALESCE(v.health_based, false) AS health_based,
+               COALESCE(v.active, false) AS active
+        FROM sdwa_pub_water_systems p
+        LEFT JOIN (
+            SELECT pwsid, bool_or(health_based) AS health_based, bool_or(active) AS active
+            FROM violations
+            GROUP BY pwsid
+        ) v ON v.pwsid = p.pwsid
+    )
+    SELECT 'all' AS dimension, '' AS value, COUNT(*) AS total_systems,
+           COUNT(*) FILTER (WHERE health_based) AS total_systems_with_violations,
+           COUNT(*) FILTER (WHERE active) AS active_systems_with_violations
+    FROM systems
+    UNION ALL
+    SELECT 'pws_type_code', pws_type_code, COUNT(*), COUNT(*) FILTER (WHERE health_based), COUNT(*) FILTER (WHERE active)
+    FROM systems WHERE pws_type_code IS NOT NULL GROUP BY pws_type_code
+    UNION ALL
+    SELECT 'gw_sw_code', gw_sw_code, COUNT(*), COUNT(*) FILTER (WHERE health_based), COUNT(*) FILTER (WHERE active)
+    FROM systems WHERE gw_sw_code IS NOT NULL GROUP BY gw_sw_code
+    UNION ALL
+    SELECT 'county', c.county_served, COUNT(*), COUNT(*) FILTER (WHERE s.health_based), COUNT(*) FILTER (WHERE s.active)
+    FROM (
+        SELECT DISTINCT pwsid, county_served FROM sdwa_geographic_areas WHERE county_served IS NOT NULL
+    ) c
+    JOIN systems s ON s.pwsid = c.pwsid
+    GROUP BY c.county_served
+    UNION ALL
+    SELECT 'contaminant', contaminant_code, COUNT(DISTINCT pwsid),
+           COUNT(DISTINCT pwsid) FILTER (WHERE health_based), COUNT(DISTINCT pwsid) FILTER (WHERE active)
+    FROM violations WHERE contaminant_code IS NOT NULL GROUP BY contaminant_code
+    UNION ALL
+    SELECT 'quarter', quarter, COUNT(DISTINCT pwsid),
+           COUNT(DISTINCT pwsid) FILTER (WHERE health_based), COUNT(DISTINCT pwsid) FILTER (WHERE active)
+    FROM violations WHERE quarter IS NOT NULL GROUP BY quarter
+"""
@@ -1,7 +1,10 @@
-from pydantic import BaseModel
+from pydantic import VERSION as PYDANTIC_VERSION, BaseModel, Field
 from typing import Optional, List
 from datetime import date
 
+# pydantic 2 renamed the list length constraint.
+_MAX_ITEMS = "max_length" if PYDANTIC_VERSION.startswith("2.") else "max_items"
+
 class PublicWaterSystemBase(BaseModel):
     pwsid: str
     pws_name: Optional[str] = None
@@ -16,6 +19,13 @@ class PublicWaterSystemBase(BaseModel):
     alt_phone_number: Optional[str] = None
     fax_number: Optional[str] = None
 
+class AutocompleteEntry(BaseModel):
+    pwsid: str
+    pws_name: Optional[str] = None
+    city_name: Optional[str] = None
+    zip_code: Optional[str] = None
+    population_served_count: Optional[int] = None
+
 class PublicWaterSystemCreate(PublicWaterSystemBase):
     pass
 
@@ -65,7 +75,7 @@ class TokenData(BaseModel):
 
 class MapOverview(BaseModel):
     pwsid: str
-    pws_name: str
+    pws_name: Optional[str] = None
     geom: str
     status: str
 
@@ -101,3 +111,32 @@ class SystemHistory(BaseModel):
     site_visits: List[SiteVisit]
     lcr_samples: List[LcrSample]
     events_milestones: List[EventMilestone]
+    next_cursor: Optional[str] = None
+
+class BatchPoint(BaseModel):
+    lat: float
+    lon: float
+
+# The largest number of pwsids, and separately of points, one batch request may resolve.
+MAX_BATCH_SIZE = 500
+
+class BatchLookupRequest(BaseModel):
+    pwsids: List[str] = Field(default_factory=list, **{_MAX_ITEMS: MAX_BATCH_SIZE})
+    points: List[BatchPoint] = Field(default_factory=list, **{_MAX_ITEMS: MAX_BATCH_SIZE})
+
+class BatchSystem(BaseModel):
+    system: PublicWaterSystem
+    status: str
+    violation_count: int
+    health_based_violation_count: int
+    active_violation_count: int
+
+class BatchPointResult(BaseModel):
+    lat: float
+    lon: float
+    pwsid: Optional[str] = None
+
+class BatchLookupResponse(BaseModel):
+    systems: List[BatchSystem]
+    points: List[BatchPointResult]
+    not_found: List[str]
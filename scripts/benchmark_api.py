@@ -0,0 +1,71 @@
+import argparse
+import itertools
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# The routes served by the async database layer, plus a threadpool-bound one for comparison.
+DEFAULT_PATHS = [
+    "/systems/by-id/GA0010000",
+    "/systems/GA0010000/status",
+    "/systems/search?query=atlanta&limit=20",
+    "/systems/nearby?lat=33.749&lon=-84.388&limit=5",
+    "/statistics",
+    "/systems/by-zip/30303",
+]
+
+
+def fetch(url, timeout):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = response.status < 500
+    except urllib.error.HTTPError as e:
+        ok = e.code < 500
+    except OSError:
+        ok = False
+    return ok, time.perf_counter() - started
+
+def run_level(base_url, paths, concurrency, total, timeout):
+    """Fires `total` requests round-robin over `paths` with `concurrency` in flight."""
+    urls = [base_url + path for path in itertools.islice(itertools.cycle(paths), total)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda url: fetch(url, timeout), urls))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for ok, _ in results if not ok)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"  concurrency {concurrency:>4}: {total / elapsed:8.1f} req/s, "
+          f"p50 {quantiles[49] * 1000:7.1f}ms, p95 {quantiles[94] * 1000:7.1f}ms, "
+          f"p99 {quantiles[98] * 1000:7.1f}ms, errors {errors}")
+
+def main():
+    """Measures throughput and latency of the read routes at increasing concurrency.
+
+    Run it against a deployment before and after a change to compare, e.g.
+    `python scripts/benchmark_api.py --base-url http://localhost:8000 --concurrency 10 100 400`.
+    """
+    parser = argparse.ArgumentParser(description="Load-test the read endpoints of the API.")
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per concurrency level.")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--path', action='append', dest='paths', help="Path to request; repeatable.")
+    args = parser.parse_args()
+
+    paths = args.paths or DEFAULT_PATHS
+    base_url = args.base_url.rstrip('/')
+    print(f"Benchmarking {base_url} over {len(paths)} paths, {args.requests} requests per level:")
+    fetch(base_url + paths[0], args.timeout)  # warm up connections and caches
+    for concurrency in args.concurrency:
+        run_level(base_url, paths, concurrency, args.requests, args.timeout)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
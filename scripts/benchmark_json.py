@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import crud
+import database
+import schemas
+from sqlalchemy import text
+
+
+# Floats that json.dumps and orjson spell differently, or that only one of them accepts.
+EDGE_FLOATS = [1e-05, 1e16, 1.5e300, 0.1, float("nan"), float("inf")]
+
+def heaviest_pwsid(db):
+    return db.execute(text("""
+        SELECT pwsid FROM sdwa_violations_enforcement GROUP BY pwsid ORDER BY count(*) DESC LIMIT 1;
+    """)).scalar()
+
+def payloads(db, repeat):
+    """The map overview and the largest system history, each as the (value, schema) the API encodes."""
+    overview = crud.get_map_overview(db) * repeat
+    pwsid = heaviest_pwsid(db) or "GA0010000"
+    history = crud.get_system_history(db, pwsid, limit=5000)
+    return {
+        f"map_overview ({len(overview)} rows)": (overview, List[schemas.MapOverview]),
+        f"history {pwsid} ({sum(len(history[section]) for section in crud.HISTORY_SECTIONS)} rows)":
+            (history, schemas.SystemHistory),
+    }
+
+def best_of(encode, value, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        body = encode(value)
+        timings.append(time.perf_counter() - started)
+    return body, min(timings)
+
+def encoded(encode, value):
+    try:
+        return encode(value).decode()
+    except ValueError as e:
+        return f"raises {type(e).__name__}"
+
+def report_edge_floats():
+    """Prints how each path encodes the floats where they can differ; these are not counted as mismatches."""
+    print("Edge floats, validated vs fast:")
+    for value in EDGE_FLOATS:
+        validated, fast = encoded(cache.encode, value), encoded(cache.encode_fast, value)
+        print(f"  {value!r}: {validated} vs {fast}{'' if validated == fast else ' (differs)'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the validated JSON encoding with the fast path.")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=1, help="Replicate the map overview rows to a statewide size.")
+    args = parser.parse_args()
+
+    print(f"Fast path encoder: {'orjson' if cache.orjson else 'json.dumps'}")
+    report_edge_floats()
+    mismatches = 0
+    with database.SessionLocal() as db:
+        for name, (value, schema) in payloads(db, args.repeat).items():
+            validated, validated_seconds = best_of(lambda v: cache.encode(v, schema), value, args.iterations)
+            fast, fast_seconds = best_of(cache.encode_fast, value, args.iterations)
+            if fast == validated:
+                verdict = "identical bytes"
+            elif json.loads(fast) == json.loads(validated):
+                # e.g. a float column holding a whole number, 0 here and 0.0 after validation,
+                # or an exponent orjson spells differently.
+                verdict = "identical after parsing"
+            else:
+                verdict = "MISMATCH"
+                mismatches += 1
+            print(f"{name}: validated {validated_seconds * 1000:.2f}ms, fast {fast_seconds * 1000:.2f}ms "
+                  f"({validated_seconds / fast_seconds:.1f}x), {len(fast):,} bytes, {verdict}")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import sys
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_crud
+import crud
+import database
+
+# Each check runs the real crud function and EXPLAINs every statement it
+# issued. Planning happens with sequential scans disabled, so a scan of a
+# whole table, or a walk of a whole index without an index condition, only
+# shows up when no index can serve the query, whatever the size of the tables.
+CHECKS = {
+    "get_user_by_username": lambda db, sample: crud.get_user_by_username(db, "admin"),
+    "get_pws_by_id": lambda db, sample: crud.get_pws_by_id(db, sample["pwsid"]),
+    "get_pws_by_ids": lambda db, sample: crud.get_pws_by_ids(db, [sample["pwsid"], "GA0000000"]),
+    "get_pws_by_name": lambda db, sample: crud.get_pws_by_name(db, "county"),
+    "get_pws_by_zip": lambda db, sample: crud.get_pws_by_zip(db, sample["zip_code"]),
+    "search_systems (zip)": lambda db, sample: crud.search_systems(db, sample["zip_code"]),
+    "search_systems (pwsid prefix)": lambda db, sample: crud.search_systems(db, sample["pwsid"][:4]),
+    "search_systems (name)": lambda db, sample: crud.search_systems(db, "county water"),
+    "get_violations_by_pwsid": lambda db, sample: crud.get_violations_by_pwsid(db, sample["pwsid"]),
+    "get_water_system_status": lambda db, sample: crud.get_water_system_status(db, sample["pwsid"]),
+    "refresh_system_status": lambda db, sample: crud.refresh_system_status(db, sample["pwsid"]),
+    "acknowledge_violation": lambda db, sample: crud.acknowledge_violation(db, sample["violation_id"]),
+    "get_nearest_systems": lambda db, sample: crud.get_nearest_systems(db, 33.75, -84.39, limit=5),
+    # A radius that holds fewer than `limit` systems must not walk the whole index.
+    "get_nearest_systems (max distance)": lambda db, sample: crud.get_nearest_systems(
+        db, 33.75, -84.39, limit=5, max_distance_m=500
+    ),
+    "get_dataset_version": lambda db, sample: crud.get_dataset_version(db),
+    "get_system_history": lambda db, sample: crud.get_system_history(db, sample["pwsid"]),
+}
+ASYNC_CHECKS = {
+    "get_system_statistics (statewide)": lambda db, sample: async_crud.get_system_statistics(db),
+    "get_system_statistics (filter)": lambda db, sample: async_crud.get_system_statistics(
+        db, filters={"gw_sw_code": "GW"}
+    ),
+    "get_system_statistics (breakdown)": lambda db, sample: async_crud.get_system_statistics(db, breakdown="county"),
+    "get_nearest_pwsids_for_points": lambda db, sample: async_crud.get_nearest_pwsids_for_points(
+        db, [(33.75, -84.39), (31.58, -84.16)]
+    ),
+    "get_nearest_pwsids (max distance)": lambda db, sample: async_crud.get_nearest_pwsids(
+        db, 33.75, -84.39, limit=5, max_distance_m=500
+    ),
+    "get_violation_counts": lambda db, sample: async_crud.get_violation_counts(db, [sample["pwsid"], "GA0000000"]),
+}
+# Whole-table reads by design, so a sequential scan is the right plan:
+# crud.get_system_statistics, async_crud.get_system_statistics before the first
+# rollup, get_autocomplete_rows, get_geographic_points, get_map_overview.
+
+# Transaction control (e.g. the savepoints checks run in) can't be explained.
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def sample_row(db):
+    """A real system with a violation to look up, so the checked statements match what the API sends."""
+    row = db.execute(text("""
+        SELECT p.pwsid, p.zip_code, v.violation_id
+        FROM sdwa_violations_enforcement v JOIN sdwa_pub_water_systems p ON p.pwsid = v.pwsid
+        LIMIT 1;
+    """)).first()
+    if row is None:
+        return {"pwsid": "GA0000000", "zip_code": "30301", "violation_id": "0"}
+    return {"pwsid": row.pwsid, "zip_code": row.zip_code or "", "violation_id": row.violation_id}
+
+def _recorder(statements):
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(EXPLAINABLE):
+            statements.append((statement, parameters))
+    return record
+
+def capture_statements(check, sample):
+    """Runs `check` in a rolled-back transaction, commits included, and returns the (sql, parameters) it executed."""
+    statements = []
+    record = _recorder(statements)
+    with database.engine.connect() as conn:
+        transaction = conn.begin()
+        db = Session(bind=conn, join_transaction_mode="create_savepoint")
+        event.listen(conn, "before_cursor_execute", record)
+        try:
+            check(db, sample)
+        finally:
+            event.remove(conn, "before_cursor_execute", record)
+            db.close()
+            transaction.rollback()
+    return statements
+
+def full_scans(plan):
+    """Yields a description of every node in an EXPLAIN (FORMAT JSON) plan tree that reads a whole table or index.
+
+    An index scan with no condition but an "Order By" is a KNN walk that
+    stops at the LIMIT, so it isn't one.
+    """
+    node_type = plan.get("Node Type")
+    if node_type == "Seq Scan":
+        yield f"Seq Scan on {plan['Relation Name']}"
+    elif node_type in ("Index Scan", "Index Only Scan") and "Index Cond" not in plan and "Order By" not in plan:
+        yield f"full {node_type} of {plan['Index Name']}"
+    for child in plan.get("Plans", []):
+        yield from full_scans(child)
+
+def _parse(plan):
+    (plan,) = json.loads(plan) if isinstance(plan, str) else plan
+    return plan["Plan"]
+
+def check_plans(check, sample):
+    """Returns (statement count, full scans) for a sync crud check."""
+    statements = capture_statements(check, sample)
+    raw = database.engine.raw_connection()
+    try:
+        scans = []
+        with raw.cursor() as cur:
+            cur.execute("SET enable_seqscan = off;")
+            for statement, parameters in statements:
+                cur.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+                scans += full_scans(_parse(cur.fetchone()[0]))
+        return len(statements), scans
+    finally:
+        raw.rollback()
+        raw.close()
+
+async def _check_async_plans(check, sample):
+    statements = []
+    record = _recorder(statements)
+    async with database.async_engine.connect() as conn:
+        transaction = await conn.begin()
+        db = AsyncSession(bind=conn, join_transaction_mode="create_savepoint")
+        event.listen(conn.sync_connection, "before_cursor_execute", record)
+        try:
+            await check(db, sample)
+        finally:
+            event.remove(conn.sync_connection, "before_cursor_execute", record)
+            await db.close()
+            await transaction.rollback()
+
+        scans = []
+        async with conn.begin():
+            await conn.exec_driver_sql("SET LOCAL enable_seqscan = off;")
+            for statement, parameters in statements:
+                plan = (await conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters)).scalar()
+                scans += full_scans(_parse(plan))
+    return len(statements), scans
+
+def check_async_plans(check, sample):
+    """`check_plans` for an async_crud check, run on the asyncpg engine."""
+    async def run():
+        try:
+            return await _check_async_plans(check, sample)
+        finally:
+            await database.async_engine.dispose()
+    return asyncio.run(run())
+
+def main():
+    """Fails if any checked crud query plans a full table or index scan."""
+    with database.SessionLocal() as db:
+        sample = sample_row(db)
+
+    checks = [(name, check, check_plans) for name, check in CHECKS.items()]
+    checks += [(name, check, check_async_plans) for name, check in ASYNC_CHECKS.items()]
+    failures = 0
+    for name, check, run in checks:
+        try:
+            count, scans = run(check, sample)
+        except Exception as e:
+            failures += 1
+            print(f"  [ERROR] {name}: {str(e).splitlines()[0]}")
+            continue
+
+        if scans:
+            failures += 1
+            print(f"  [FULL SCAN] {name}: {', '.join(sorted(set(scans)))}")
+        else:
+            print(f"  [OK] {name}: {count} statement(s)")
+
+    print(f"{len(checks) - failures}/{len(checks)} query checks use indexes.")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
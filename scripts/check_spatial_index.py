@@ -0,0 +1,65 @@
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud
+from spatial_index import GridIndex
+
+
+def get_db_connection():
+    """Establishes a connection to the PostgreSQL database."""
+    return psycopg2.connect(
+        host="localhost",
+        database="water_data",
+        user="user",
+        password="password"
+    )
+
+def postgis_nearest(cur, lat, lon):
+    cur.execute("""
+        SELECT pwsid, geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
+        FROM sdwa_geographic_areas
+        WHERE geom IS NOT NULL
+        ORDER BY geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
+        LIMIT 1;
+    """, (lon, lat, lon, lat))
+    return cur.fetchone()
+
+def main(samples=1000):
+    """Checks that the in-memory grid index agrees with the PostGIS KNN lookup on random points."""
+    conn = get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT pwsid, ST_Y(geom), ST_X(geom) FROM sdwa_geographic_areas WHERE geom IS NOT NULL;")
+        points = cur.fetchall()
+    if not points:
+        print("No geocoded geographic areas, nothing to check.")
+        return 0
+
+    index = GridIndex([p[0] for p in points], [p[1] for p in points], [p[2] for p in points])
+    mismatches = 0
+    index_seconds = 0.0
+    with conn.cursor() as cur:
+        for _ in range(samples):
+            lat = random.uniform(*crud.GEORGIA_LAT_RANGE)
+            lon = random.uniform(*crud.GEORGIA_LON_RANGE)
+            started = time.perf_counter()
+            (pwsid, distance), = index.nearest(lat, lon)
+            index_seconds += time.perf_counter() - started
+            expected_pwsid, expected_distance = postgis_nearest(cur, lat, lon)
+            # Equidistant areas may legitimately come back in either order.
+            if pwsid != expected_pwsid and abs(distance - expected_distance) > 1e-9:
+                mismatches += 1
+                print(f"  [MISMATCH] ({lat:.5f}, {lon:.5f}): index={pwsid} postgis={expected_pwsid}")
+    conn.close()
+
+    print(f"{samples - mismatches}/{samples} points agree; "
+          f"mean index lookup {index_seconds / samples * 1e6:.1f}us over {len(index)} areas.")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
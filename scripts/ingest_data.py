@@ -1,131 +1,442 @@
+import argparse
+import io
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
-import glob
+import psycopg2.errors
+from psycopg2.pool import ThreadedConnectionPool
+from sqlalchemy import Date, Integer, Numeric, String
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import rollups
+
+DB_PARAMS = {
+    "host": "localhost",
+    "database": "water_data",
+    "user": "user",
+    "password": "password",
+}
+
+# Mapping of CSV filenames to table names
+FILE_TO_TABLE_MAP = {
+    'SDWA_PUB_WATER_SYSTEMS.csv': 'sdwa_pub_water_systems',
+    'SDWA_GEOGRAPHIC_AREAS.csv': 'sdwa_geographic_areas',
+    'SDWA_FACILITIES.csv': 'sdwa_facilities',
+    'SDWA_VIOLATIONS_ENFORCEMENT.csv': 'sdwa_violations_enforcement',
+    'SDWA_LCR_SAMPLES.csv': 'sdwa_lcr_samples',
+    'SDWA_REF_CODE_VALUES.csv': 'sdwa_ref_code_values',
+    'SDWA_EVENTS_MILESTONES.csv': 'sdwa_events_milestones',
+    'SDWA_PN_VIOLATION_ASSOC.csv': 'sdwa_pn_violation_assoc',
+    'SDWA_SERVICE_AREAS.csv': 'sdwa_service_areas',
+    'SDWA_SITE_VISITS.csv': 'sdwa_site_visits'
+}
+
+# Every other table references this one, so it is loaded before the rest.
+PARENT_TABLE = 'sdwa_pub_water_systems'
+
+TABLE_MODELS = {
+    model.__tablename__: model
+    for model in (
+        models.PublicWaterSystem,
+        models.GeographicArea,
+        models.Facility,
+        models.Violation,
+        models.LcrSample,
+        models.RefCodeValue,
+        models.EventMilestone,
+        models.PnViolationAssoc,
+        models.ServiceArea,
+        models.SiteVisit,
+    )
+}
+
+# Rows with these columns missing cannot be inserted
+REQUIRED_KEYS = {
+    'sdwa_ref_code_values': ['value_type', 'value_code'],
+    'sdwa_violations_enforcement': ['violation_id'],
+}
+
+# The extracts repeat some keys; the first occurrence wins
+UNIQUE_KEYS = {
+    'sdwa_pn_violation_assoc': ['pwsid', 'pn_violation_id'],
+    'sdwa_violations_enforcement': ['violation_id'],
+}
+
+DATE_FORMAT = '%m/%d/%Y'
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+CHUNK_ROWS = 50000
 
 def get_db_connection():
     """Establishes a connection to the PostgreSQL database."""
-    return psycopg2.connect(
-        host="localhost",
-        database="water_data",
-        user="user",
-        password="password"
-    )
+    return psycopg2.connect(**DB_PARAMS)
+
+def column_kinds(table_name):
+    """Maps each CSV-backed column of the table's model to 'date', 'int', 'numeric' or 'str'."""
+    kinds = {}
+    for column in TABLE_MODELS[table_name].__table__.columns:
+        if isinstance(column.type, Date):
+            kinds[column.name] = 'date'
+        elif isinstance(column.type, Integer):
+            kinds[column.name] = 'int'
+        elif isinstance(column.type, Numeric):
+            kinds[column.name] = 'numeric'
+        elif isinstance(column.type, String):
+            kinds[column.name] = 'str'
+        # Anything else (the geometry column) is not part of the CSV extracts.
+    return kinds
 
-def clean_and_prepare_data(df, table_name):
-    """Cleans and prepares the DataFrame for insertion."""
+
+def clean_and_prepare_data(df, table_name, kinds, seen_keys):
+    """Cleans one chunk for insertion; `seen_keys` carries primary keys across chunks."""
     # Convert column names to lowercase to match schema
     df.columns = [col.lower() for col in df.columns]
 
-    # Drop duplicate/unwanted columns before processing
-    if table_name == 'sdwa_violations_enforcement' or table_name == 'sdwa_pn_violation_assoc':
-        df = df.drop(columns=['compl_per_begin_date', 'compl_per_end_date'], errors='ignore')
-    if table_name == 'sdwa_violations_enforcement':
-        df = df.drop(columns=['pws_deactivation_date'], errors='ignore')
-
-
-    # Handle date columns - convert to None if invalid
-    date_columns = [
-        'pws_deactivation_date', 'first_reported_date', 'last_reported_date',
-        'source_protection_begin_date', 'outstanding_perform_begin_date',
-        'reduced_monitoring_begin_date', 'reduced_monitoring_end_date',
-        'facility_deactivation_date', 'non_compl_per_begin_date',
-        'non_compl_per_end_date', 'calculated_rtc_date', 'enforcement_date',
-        'viol_first_reported_date', 'viol_last_reported_date',
-        'enf_first_reported_date', 'enf_last_reported_date',
-        'sampling_end_date', 'sampling_start_date',
-        'sample_first_reported_date', 'sample_last_reported_date',
-        'sar_first_reported_date', 'sar_last_reported_date',
-        'event_end_date', 'event_actual_date', 'visit_date'
-    ]
-
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-            # Convert NaT to None, then format to date string
-            df[col] = df[col].apply(lambda x: x.date() if pd.notnull(x) else None)
-
-    # Replace numpy.nan with None for SQL compatibility
-    df = df.where(pd.notnull(df), None)
-
-    if table_name == 'sdwa_violations_enforcement':
-        int_cols = ['public_notification_tier', 'calculated_pub_notif_tier']
-        for col in int_cols:
-            # Coerce to numeric, then fill NA with a placeholder, convert to int, and replace placeholder with None
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-1).astype(int).replace(-1, None)
-
-    # Special handling for ref_code_values to prevent null primary keys
-    if table_name == 'sdwa_ref_code_values':
-        df.dropna(subset=['value_type', 'value_code'], inplace=True)
-
-    # Special handling for pn_violation_assoc to prevent duplicate primary keys
-    if table_name == 'sdwa_pn_violation_assoc':
-        df.drop_duplicates(subset=['pwsid', 'pn_violation_id'], keep='first', inplace=True)
-
-    if table_name == 'sdwa_violations_enforcement':
-        df.dropna(subset=['violation_id'], inplace=True)
-        df.drop_duplicates(subset=['violation_id'], keep='first', inplace=True)
+    # Columns arrive as strings (or NaN); convert the typed ones in bulk
+    for col in df.columns:
+        kind = kinds[col]
+        if kind == 'date':
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT, errors='coerce')
+        elif kind == 'int':
+            df[col] = np.trunc(pd.to_numeric(df[col], errors='coerce')).astype('Int64')
+        elif kind == 'numeric':
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Drop rows that would violate the primary key
+    required = REQUIRED_KEYS.get(table_name)
+    if required:
+        df = df.dropna(subset=required)
+
+    unique = UNIQUE_KEYS.get(table_name)
+    if unique:
+        df = df.drop_duplicates(subset=unique, keep='first')
+        keys = list(df[unique].itertuples(index=False, name=None))
+        df = df[[key not in seen_keys for key in keys]]
+        seen_keys.update(keys)
 
     return df
 
 
-def ingest_csv(conn, file_path, table_name):
-    """Ingests a single CSV file into the specified table."""
-    print(f"Processing {file_path} for table {table_name}...")
+def read_clean_chunks(file_path, table_name):
+    """Yields cleaned DataFrame chunks so peak memory is bounded by CHUNK_ROWS."""
+    kinds = column_kinds(table_name)
+    seen_keys = set()
+    chunks = pd.read_csv(
+        file_path,
+        chunksize=CHUNK_ROWS,
+        usecols=lambda col: col.lower() in kinds,
+        dtype=str,
+    )
+    for chunk in chunks:
+        yield clean_and_prepare_data(chunk, table_name, kinds, seen_keys)
+
+
+def copy_rows(cur, df, table_name):
+    """Streams one cleaned chunk into the table with COPY FROM STDIN."""
+    cols = ','.join(list(df.columns))
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d', float_format='%.15g')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table_name} ({cols}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def ingest_csv(conn, file_path, table_name, target):
+    """Loads a single CSV file into `target`, an empty table shaped like `table_name`."""
+    print(f"Processing {file_path} for table {target}...")
+    started = time.perf_counter()
+    rows = 0
+    try:
+        with conn.cursor() as cur:
+            for chunk in read_clean_chunks(file_path, table_name):
+                copy_rows(cur, chunk, target)
+                rows += len(chunk)
+            conn.commit()
+    except Exception as e:
+        print(f"Error ingesting {file_path}: {e}")
+        conn.rollback()
+        raise
+
+    elapsed = time.perf_counter() - started
+    print(f"Successfully ingested {rows} rows into {target} "
+          f"in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s).")
+    return rows
+
+
+def ingest_with_pool(pool, file_path, table_name, target):
+    conn = pool.getconn()
     try:
-        df = pd.read_csv(file_path, low_memory=False)
-        df = clean_and_prepare_data(df, table_name)
-        print(f"Columns for {table_name}: {list(df.columns)}")
+        return ingest_csv(conn, file_path, table_name, target)
+    finally:
+        pool.putconn(conn)
+
+
+REFRESH_SYSTEM_STATUS_SQL = """
+    TRUNCATE TABLE system_status;
+    INSERT INTO system_status (pwsid, active_violation_count, last_violation_date, status, refreshed_at)
+    SELECT p.pwsid,
+           COALESCE(v.active_violation_count, 0),
+           v.last_violation_date,
+           CASE WHEN COALESCE(v.active_violation_count, 0) = 0 THEN 'safe' ELSE 'not safe' END,
+           now()
+    FROM sdwa_pub_water_systems p
+    LEFT JOIN (
+        SELECT pwsid,
+               COUNT(*) FILTER (WHERE non_compl_per_end_date IS NULL) AS active_violation_count,
+               MAX(non_compl_per_begin_date) AS last_violation_date
+        FROM sdwa_violations_enforcement
+        WHERE is_health_based_ind = 'Y'
+        GROUP BY pwsid
+    ) v ON v.pwsid = p.pwsid;
+"""
+
 
+REFRESH_STATISTICS_ROLLUP_SQL = f"""
+    TRUNCATE TABLE statistics_rollup;
+    INSERT INTO statistics_rollup
+        (dimension, value, total_systems, total_systems_with_violations, active_systems_with_violations)
+    {rollups.STATISTICS_ROLLUP_SQL};
+"""
+
+BUMP_DATASET_VERSION_SQL = """
+    INSERT INTO dataset_version (id, version, updated_at) VALUES (1, 1, now())
+    ON CONFLICT (id) DO UPDATE
+    SET version = dataset_version.version + 1, updated_at = now()
+    RETURNING version;
+"""
+
+
+def stage_table(cur, file_path, table_name):
+    """Loads an extract into a transaction-scoped staging copy of the table; returns its columns."""
+    stage = f"stage_{table_name}"
+    cur.execute(f"CREATE TEMP TABLE {stage} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    columns = None
+    for chunk in read_clean_chunks(file_path, table_name):
+        copy_rows(cur, chunk, stage)
+        columns = list(chunk.columns)
+    return stage, columns
+
+
+def upsert_from_stage(cur, table_name, stage, columns):
+    """Inserts new rows and updates changed ones; returns the number of rows written."""
+    keys = [column.name for column in TABLE_MODELS[table_name].__table__.primary_key.columns]
+    updates = [col for col in columns if col not in keys]
+    # A changed last_reported_date marks a changed row; tables without one compare every column.
+    changed = [col for col in updates if col.endswith('last_reported_date')] or updates
+    cols = ', '.join(columns)
+    if updates:
+        on_conflict = f"""DO UPDATE
+        SET {', '.join(f'{col} = EXCLUDED.{col}' for col in updates)}
+        WHERE ({', '.join(f'{table_name}.{col}' for col in changed)})
+              IS DISTINCT FROM ({', '.join(f'EXCLUDED.{col}' for col in changed)})"""
+    else:
+        on_conflict = "DO NOTHING"
+    cur.execute(f"""
+        INSERT INTO {table_name} ({cols})
+        SELECT {cols} FROM {stage}
+        ON CONFLICT ({', '.join(keys)}) {on_conflict};
+    """)
+    return cur.rowcount
+
+
+def delete_missing(cur, table_name, stage):
+    """Deletes rows that are no longer present in the new extract."""
+    keys = [column.name for column in TABLE_MODELS[table_name].__table__.primary_key.columns]
+    match = ' AND '.join(f's.{key} = t.{key}' for key in keys)
+    cur.execute(f"DELETE FROM {table_name} t WHERE NOT EXISTS (SELECT 1 FROM {stage} s WHERE {match});")
+    return cur.rowcount
+
+
+def delta_ingest(conn, jobs):
+    """Applies a new extract as upserts and deletes in one transaction.
+
+    Readers keep seeing the previous data until the commit, and the cost
+    scales with the number of changed rows rather than the table sizes.
+    """
+    started = time.perf_counter()
+    # Parents first for inserts, children first for deletes, to satisfy the foreign keys.
+    jobs = sorted(jobs, key=lambda job: job[1] != PARENT_TABLE)
+    try:
         with conn.cursor() as cur:
-            # Clear the table before inserting new data
-            cur.execute(f"TRUNCATE TABLE {table_name} CASCADE;")
+            staged = []
+            for file_path, table_name in jobs:
+                stage, columns = stage_table(cur, file_path, table_name)
+                if columns is None:
+                    print(f"Warning: {file_path} is empty, leaving {table_name} unchanged.")
+                    continue
+                written = upsert_from_stage(cur, table_name, stage, columns)
+                print(f"Upserted {written} new or changed rows into {table_name}.")
+                staged.append((table_name, stage))
+            for table_name, stage in reversed(staged):
+                print(f"Deleted {delete_missing(cur, table_name, stage)} rows missing from {table_name}.")
+
+            cur.execute(REFRESH_SYSTEM_STATUS_SQL)
+            cur.execute(REFRESH_STATISTICS_ROLLUP_SQL)
+            cur.execute(BUMP_DATASET_VERSION_SQL)
+            version = cur.fetchone()[0]
+        conn.commit()
+        print(f"\nDelta ingestion complete in {time.perf_counter() - started:.2f}s; dataset version is now {version}.")
+    except Exception as e:
+        print(f"Error during delta ingestion, nothing was changed: {e}")
+        conn.rollback()
+        raise
+
+
+SHADOW_SCHEMA = 'sdwa_shadow'
+RETIRED_SCHEMA = 'sdwa_retired'
+# Every table a full reload replaces, including the tables derived from them.
+SWAP_TABLES = list(FILE_TO_TABLE_MAP.values()) + ['system_status', 'statistics_rollup']
+SWAP_LOCK_TIMEOUT = '5s'
+SWAP_ATTEMPTS = 5
 
-            # Prepare data for insertion
-            tuples = [tuple(x) for x in df.to_numpy()]
-            cols = ','.join(list(df.columns))
 
-            # Use execute_values for efficient bulk insertion
-            query = f"INSERT INTO {table_name} ({cols}) VALUES %s"
-            execute_values(cur, query, tuples)
+def create_shadow_tables(conn):
+    """Creates bare copies of the live tables in the shadow schema; keys and indexes come after the load."""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SHADOW_SCHEMA} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {SHADOW_SCHEMA};")
+        for table_name in SWAP_TABLES:
+            cur.execute(f"CREATE TABLE {SHADOW_SCHEMA}.{table_name} "
+                        f"(LIKE public.{table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+    conn.commit()
 
+
+def build_shadow_indexes(conn):
+    """Recreates the live tables' keys, indexes and foreign keys on the loaded shadow tables, then analyzes them."""
+    with conn.cursor() as cur:
+        statements = []
+        for table_name in SWAP_TABLES:
+            cur.execute("""
+                SELECT conname, pg_get_constraintdef(oid), contype = 'f'
+                FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f');
+            """, (f"public.{table_name}",))
+            for name, definition, is_foreign_key in cur.fetchall():
+                statements.append((is_foreign_key, f"ALTER TABLE {table_name} ADD CONSTRAINT {name} {definition};"))
+            cur.execute("""
+                SELECT indexdef FROM pg_indexes i
+                WHERE schemaname = 'public' AND tablename = %s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM pg_constraint c
+                      WHERE c.conname = i.indexname AND c.conrelid = %s::regclass
+                  );
+            """, (table_name, f"public.{table_name}"))
+            for (definition,) in cur.fetchall():
+                statements.append((False, definition.replace(f" ON public.{table_name} ", f" ON {table_name} ")))
+
+        # The definitions above were rendered against public; resolve them in the shadow schema
+        # instead, so foreign keys point at the shadow parent. Primary keys go in before foreign keys.
+        cur.execute(f"SET LOCAL search_path TO {SHADOW_SCHEMA}, public;")
+        for _, statement in sorted(statements, key=lambda item: item[0]):
+            cur.execute(statement)
+        cur.execute(REFRESH_SYSTEM_STATUS_SQL)
+        cur.execute(REFRESH_STATISTICS_ROLLUP_SQL)
+        # Fresh statistics, so the first queries after the swap get good plans.
+        for table_name in SWAP_TABLES:
+            cur.execute(f"ANALYZE {table_name};")
+    conn.commit()
+
+
+def swap_shadow_tables(conn):
+    """Moves the shadow tables into public in a single transaction and returns the new dataset version."""
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with conn.cursor() as cur:
+                # Fail fast instead of queueing readers behind a long-running query.
+                cur.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';")
+                cur.execute(f"DROP SCHEMA IF EXISTS {RETIRED_SCHEMA} CASCADE;")
+                cur.execute(f"CREATE SCHEMA {RETIRED_SCHEMA};")
+                for table_name in SWAP_TABLES:
+                    cur.execute(f"ALTER TABLE public.{table_name} SET SCHEMA {RETIRED_SCHEMA};")
+                    cur.execute(f"ALTER TABLE {SHADOW_SCHEMA}.{table_name} SET SCHEMA public;")
+                cur.execute(BUMP_DATASET_VERSION_SQL)
+                version = cur.fetchone()[0]
             conn.commit()
-            print(f"Successfully ingested {len(df)} rows into {table_name}.")
+            return version
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"Swap attempt {attempt} timed out waiting for readers, retrying...")
+    raise RuntimeError(f"Could not acquire the table locks for the swap after {SWAP_ATTEMPTS} attempts")
+
+
+def full_ingest(jobs):
+    """Rebuilds every table in a shadow schema and swaps it in atomically.
+
+    The API keeps reading the previous tables at full speed until the swap,
+    and a failure at any point before it leaves them untouched.
+    """
+    started = time.perf_counter()
+    loaded = {table_name for _, table_name in jobs}
+    # One connection for the orchestration plus one per load worker.
+    pool = ThreadedConnectionPool(1, INGEST_WORKERS + 1, **DB_PARAMS)
+    conn = pool.getconn()
+    try:
+        create_shadow_tables(conn)
 
+        # The shadow tables have no foreign keys yet, so every table loads in parallel.
+        with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+            futures = [
+                executor.submit(ingest_with_pool, pool, file_path, table_name, f"{SHADOW_SCHEMA}.{table_name}")
+                for file_path, table_name in jobs
+            ]
+            total_rows = sum(future.result() for future in futures)
+
+        # Tables without a new extract keep their current contents.
+        with conn.cursor() as cur:
+            for table_name in FILE_TO_TABLE_MAP.values():
+                if table_name not in loaded:
+                    cur.execute(f"INSERT INTO {SHADOW_SCHEMA}.{table_name} SELECT * FROM public.{table_name};")
+        conn.commit()
+
+        build_shadow_indexes(conn)
+        version = swap_shadow_tables(conn)
+
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {RETIRED_SCHEMA} CASCADE;")
+            cur.execute(f"DROP SCHEMA {SHADOW_SCHEMA} CASCADE;")
+        conn.commit()
     except Exception as e:
-        print(f"Error ingesting {file_path}: {e}")
+        print(f"Error during full ingestion, the live tables were left untouched: {e}")
         conn.rollback()
+        return
+    finally:
+        pool.putconn(conn)
+        pool.closeall()
+
+    elapsed = time.perf_counter() - started
+    print(f"\nData ingestion complete: {total_rows} rows in {elapsed:.2f}s ({total_rows / elapsed:,.0f} rows/s); "
+          f"dataset version is now {version}.")
 
 
 def main():
     """Main function to orchestrate the data ingestion process."""
-    conn = get_db_connection()
-
-    # Mapping of CSV filenames to table names
-    file_to_table_map = {
-        'SDWA_PUB_WATER_SYSTEMS.csv': 'sdwa_pub_water_systems',
-        'SDWA_GEOGRAPHIC_AREAS.csv': 'sdwa_geographic_areas',
-        'SDWA_FACILITIES.csv': 'sdwa_facilities',
-        'SDWA_VIOLATIONS_ENFORCEMENT.csv': 'sdwa_violations_enforcement',
-        'SDWA_LCR_SAMPLES.csv': 'sdwa_lcr_samples',
-        'SDWA_REF_CODE_VALUES.csv': 'sdwa_ref_code_values',
-        'SDWA_EVENTS_MILESTONES.csv': 'sdwa_events_milestones',
-        'SDWA_PN_VIOLATION_ASSOC.csv': 'sdwa_pn_violation_assoc',
-        'SDWA_SERVICE_AREAS.csv': 'sdwa_service_areas',
-        'SDWA_SITE_VISITS.csv': 'sdwa_site_visits'
-    }
-
-    data_dir = 'data'
-    for file_name, table_name in file_to_table_map.items():
-        file_path = os.path.join(data_dir, file_name)
+    parser = argparse.ArgumentParser(description="Load the SDWA CSV extracts into Postgres.")
+    parser.add_argument('--mode', choices=['full', 'delta'], default='full',
+                        help="'full' rebuilds every table and swaps it in; 'delta' upserts changes in one transaction.")
+    parser.add_argument('--data-dir', default='data')
+    args = parser.parse_args()
+
+    jobs = []
+    for file_name, table_name in FILE_TO_TABLE_MAP.items():
+        file_path = os.path.join(args.data_dir, file_name)
         if os.path.exists(file_path):
-            ingest_csv(conn, file_path, table_name)
+            jobs.append((file_path, table_name))
         else:
             print(f"Warning: File not found - {file_path}")
 
-    conn.close()
-    print("\nData ingestion complete.")
+    if args.mode == 'delta':
+        conn = get_db_connection()
+        try:
+            delta_ingest(conn, jobs)
+        finally:
+            conn.close()
+    else:
+        full_ingest(jobs)
 
 if __name__ == "__main__":
     main()
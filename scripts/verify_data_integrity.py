@@ -1,73 +1,114 @@
+import argparse
+import hashlib
 import os
-import pandas as pd
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
-from psycopg2.extras import execute_values
-import glob
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    return psycopg2.connect(
-        host="localhost",
-        database="water_data",
-        user="user",
-        password="password"
-    )
-
-def clean_and_prepare_data(df, table_name):
-    """Cleans and prepares the DataFrame for insertion."""
-    # Convert column names to lowercase to match schema
-    df.columns = [col.lower() for col in df.columns]
-
-    # Drop duplicate/unwanted columns before processing
-    if table_name == 'sdwa_violations_enforcement' or table_name == 'sdwa_pn_violation_assoc':
-        df = df.drop(columns=['compl_per_begin_date', 'compl_per_end_date'], errors='ignore')
-    if table_name == 'sdwa_violations_enforcement':
-        df = df.drop(columns=['pws_deactivation_date'], errors='ignore')
-
-
-    # Handle date columns - convert to None if invalid
-    date_columns = [
-        'pws_deactivation_date', 'first_reported_date', 'last_reported_date',
-        'source_protection_begin_date', 'outstanding_perform_begin_date',
-        'reduced_monitoring_begin_date', 'reduced_monitoring_end_date',
-        'facility_deactivation_date', 'non_compl_per_begin_date',
-        'non_compl_per_end_date', 'calculated_rtc_date', 'enforcement_date',
-        'viol_first_reported_date', 'viol_last_reported_date',
-        'enf_first_reported_date', 'enf_last_reported_date',
-        'sampling_end_date', 'sampling_start_date',
-        'sample_first_reported_date', 'sample_last_reported_date',
-        'sar_first_reported_date', 'sar_last_reported_date',
-        'event_end_date', 'event_actual_date', 'visit_date'
-    ]
-
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-            # Convert NaT to None, then format to date string
-            df[col] = df[col].apply(lambda x: x.date() if pd.notnull(x) else None)
-
-    # Replace numpy.nan with None for SQL compatibility
-    df = df.where(pd.notnull(df), None)
+from ingest_data import DB_PARAMS, FILE_TO_TABLE_MAP, column_kinds, read_clean_chunks
 
-    if table_name == 'sdwa_violations_enforcement':
-        int_cols = ['public_notification_tier', 'calculated_pub_notif_tier']
-        for col in int_cols:
-            # Coerce to numeric, then fill NA with a placeholder, convert to int, and replace placeholder with None
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-1).astype(int).replace(-1, None)
+# Rows are grouped into buckets by a hash of this column, so a mismatch
+# narrows down to a small slice of systems.
+BUCKET_COLUMNS = {'sdwa_ref_code_values': 'value_type'}
+DEFAULT_BUCKET_COLUMN = 'pwsid'
 
-    # Special handling for ref_code_values to prevent null primary keys
-    if table_name == 'sdwa_ref_code_values':
-        df.dropna(subset=['value_type', 'value_code'], inplace=True)
+NULL_TEXT = '\\N'
+SEPARATOR = '\x1f'
 
-    # Special handling for pn_violation_assoc to prevent duplicate primary keys
-    if table_name == 'sdwa_pn_violation_assoc':
-        df.drop_duplicates(subset=['pwsid', 'pn_violation_id'], keep='first', inplace=True)
-
-    if table_name == 'sdwa_violations_enforcement':
-        df.dropna(subset=['violation_id'], inplace=True)
-        df.drop_duplicates(subset=['violation_id'], keep='first', inplace=True)
+def get_db_connection():
+    """Establishes a connection to the PostgreSQL database."""
+    return psycopg2.connect(**DB_PARAMS)
+
+def pg_float_text(value):
+    """Formats a float the way Postgres prints float8 (shortest round-trip, no trailing '.0')."""
+    text = repr(float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+def md5_int(text, hex_digits):
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:hex_digits], 16)
+
+def csv_checksums(file_path, table_name, buckets):
+    """Streams the cleaned CSV and returns ({bucket: [rows, checksum]}, columns)."""
+    kinds = column_kinds(table_name)
+    bucket_column = BUCKET_COLUMNS.get(table_name, DEFAULT_BUCKET_COLUMN)
+    sums = defaultdict(lambda: [0, 0])
+    columns = None
+    for chunk in read_clean_chunks(file_path, table_name):
+        columns = list(chunk.columns)
+        texts = []
+        for col in columns:
+            values = chunk[col]
+            kind = kinds[col]
+            if kind == 'date':
+                text = values.dt.strftime('%Y-%m-%d')
+            elif kind == 'int':
+                text = values.astype('string')
+            elif kind == 'numeric':
+                text = values.map(pg_float_text, na_action='ignore')
+            else:
+                text = values
+            texts.append(text.astype(object).where(values.notna(), NULL_TEXT))
+        keys = chunk[bucket_column].fillna('')
+        for key, row in zip(keys, zip(*texts)):
+            entry = sums[md5_int(key, 8) % buckets]
+            entry[0] += 1
+            entry[1] += md5_int(SEPARATOR.join(row), 15)
+    return dict(sums), columns
+
+def db_checksums(conn, table_name, columns, buckets):
+    """Computes the same per-bucket row counts and checksums with one aggregate query."""
+    kinds = column_kinds(table_name)
+    bucket_column = BUCKET_COLUMNS.get(table_name, DEFAULT_BUCKET_COLUMN)
+    values = [
+        f"coalesce({col}::float8::text, '{NULL_TEXT}')" if kinds[col] == 'numeric'
+        else f"coalesce({col}::text, '{NULL_TEXT}')"
+        for col in columns
+    ]
+    with conn.cursor() as cur:
+        cur.execute("SET DateStyle = ISO; SET extra_float_digits = 1;")
+        cur.execute(f"""
+            SELECT ('x' || substr(md5(coalesce({bucket_column}, '')), 1, 8))::bit(32)::bigint %% %s,
+                   COUNT(*),
+                   SUM(('x' || substr(md5(concat_ws(chr(31), {', '.join(values)})), 1, 15))::bit(60)::bigint)
+            FROM {table_name}
+            GROUP BY 1;
+        """, (buckets,))
+        return {bucket: [count, int(checksum)] for bucket, count, checksum in cur.fetchall()}
+
+def verify_table_integrity(file_path, table_name, buckets):
+    """Compares per-bucket checksums of a CSV against its table; returns report lines."""
+    started = time.perf_counter()
+    try:
+        expected, columns = csv_checksums(file_path, table_name, buckets)
+        if columns is None:
+            return [f"  [WARNING] {file_path} is empty, cannot verify {table_name}"]
+        conn = get_db_connection()
+        try:
+            actual = db_checksums(conn, table_name, columns, buckets)
+        finally:
+            conn.close()
+    except Exception as e:
+        return [f"  [ERROR] Could not verify {table_name}: {e}"]
 
-    return df
+    csv_rows = sum(count for count, _ in expected.values())
+    db_rows = sum(count for count, _ in actual.values())
+    differing = sorted(
+        bucket for bucket in set(expected) | set(actual)
+        if expected.get(bucket) != actual.get(bucket)
+    )
+    elapsed = time.perf_counter() - started
+    if not differing:
+        return [f"  [OK] {table_name}: {csv_rows} rows, all {buckets} buckets match ({elapsed:.2f}s)"]
+
+    lines = [f"  [MISMATCH] {table_name}: CSV rows ({csv_rows}) vs DB rows ({db_rows}), "
+             f"{len(differing)} of {buckets} buckets differ ({elapsed:.2f}s)"]
+    for bucket in differing:
+        csv_count = expected.get(bucket, [0, 0])[0]
+        db_count = actual.get(bucket, [0, 0])[0]
+        kind = "row counts" if csv_count != db_count else "values"
+        lines.append(f"      bucket {bucket}: {kind} differ (CSV {csv_count} rows, DB {db_count} rows)")
+    return lines
 
 def verify_health_based_violations(conn):
     """Verifies and reports the number of systems with health-based violations."""
@@ -95,56 +136,31 @@ def verify_health_based_violations(conn):
     except Exception as e:
         print(f"  [ERROR] Could not verify health-based violations: {e}")
 
-def verify_table_integrity(conn, file_path, table_name):
-    """Verifies the integrity of a single table against its CSV file."""
-    print(f"Verifying {table_name}...")
-    try:
-        # Read and clean CSV data
-        df = pd.read_csv(file_path, low_memory=False)
-        df_cleaned = clean_and_prepare_data(df, table_name)
-        csv_row_count = len(df_cleaned)
-
-        # Get row count from the database
-        with conn.cursor() as cur:
-            cur.execute(f"SELECT COUNT(*) FROM {table_name};")
-            db_row_count = cur.fetchone()[0]
-
-        # Compare counts and report
-        if csv_row_count == db_row_count:
-            print(f"  [OK] {table_name}: CSV rows ({csv_row_count}) == DB rows ({db_row_count})")
-        else:
-            print(f"  [MISMATCH] {table_name}: CSV rows ({csv_row_count}) != DB rows ({db_row_count})")
-
-    except Exception as e:
-        print(f"  [ERROR] Could not verify {table_name}: {e}")
-
 def main():
     """Main function to orchestrate the data verification process."""
-    conn = get_db_connection()
-
-    file_to_table_map = {
-        'SDWA_PUB_WATER_SYSTEMS.csv': 'sdwa_pub_water_systems',
-        'SDWA_GEOGRAPHIC_AREAS.csv': 'sdwa_geographic_areas',
-        'SDWA_FACILITIES.csv': 'sdwa_facilities',
-        'SDWA_VIOLATIONS_ENFORCEMENT.csv': 'sdwa_violations_enforcement',
-        'SDWA_LCR_SAMPLES.csv': 'sdwa_lcr_samples',
-        'SDWA_REF_CODE_VALUES.csv': 'sdwa_ref_code_values',
-        'SDWA_EVENTS_MILESTONES.csv': 'sdwa_events_milestones',
-        'SDWA_PN_VIOLATION_ASSOC.csv': 'sdwa_pn_violation_assoc',
-        'SDWA_SERVICE_AREAS.csv': 'sdwa_service_areas',
-        'SDWA_SITE_VISITS.csv': 'sdwa_site_visits'
-    }
-
-    data_dir = 'data'
-    for file_name, table_name in file_to_table_map.items():
-        file_path = os.path.join(data_dir, file_name)
+    parser = argparse.ArgumentParser(description="Verify the loaded tables against the SDWA CSV extracts.")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--buckets', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    jobs = []
+    for file_name, table_name in FILE_TO_TABLE_MAP.items():
+        file_path = os.path.join(args.data_dir, file_name)
         if os.path.exists(file_path):
-            verify_table_integrity(conn, file_path, table_name)
+            jobs.append((file_path, table_name))
         else:
             print(f"  [WARNING] File not found, cannot verify: {file_path}")
 
-    verify_health_based_violations(conn)
+    # Each table is checked in its own process, streaming the CSV and querying the DB side by side.
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(verify_table_integrity, file_path, table_name, args.buckets)
+                   for file_path, table_name in jobs]
+        for future in futures:
+            print("\n".join(future.result()))
 
+    conn = get_db_connection()
+    verify_health_based_violations(conn)
     conn.close()
     print("\nData integrity check complete.")
 
@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedSnapshot:
+    """Holds an in-process structure built from the database and hot-swaps it after ingest.
+
+    `scripts/ingest_data.py` bumps the `dataset_version` row when it finishes.
+    Requests only read the current snapshot; `refresh` rebuilds it for a new
+    version off the request path (from the dataset version poll in main.py),
+    and the previous snapshot keeps being served until the new one is swapped in.
+    """
+
+    def __init__(self, name: str, builder):
+        self.name = name
+        self._builder = builder
+        self._lock = threading.Lock()
+        # Held for a whole build, so two aren't run at once.
+        self._build_lock = threading.RLock()
+        self._value = None
+        self._version = None
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def version(self):
+        return self._version
+
+    def rebuild(self, db: Session):
+        with self._build_lock:
+            version = crud.get_dataset_version(db)
+            started = time.perf_counter()
+            value = self._builder(db)
+            with self._lock:
+                self._value, self._version = value, version
+            logger.info("Built %s for dataset version %s in %.3fs", self.name, version, time.perf_counter() - started)
+            return value
+
+    def refresh(self, db: Session, version: int):
+        """Rebuilds the snapshot if it predates dataset `version`, keeping the previous one if that fails."""
+        if self._value is not None and self._version == version:
+            return
+        try:
+            self.rebuild(db)
+        except Exception:
+            logger.exception("Could not refresh %s, serving the previous snapshot", self.name)
+
+    def get(self, db: Session):
+        """Returns the current snapshot, building it first only if there is none yet (e.g. startup failed)."""
+        if self._value is None:
+            with self._build_lock:
+                if self._value is None:
+                    return self.rebuild(db)
+        return self._value
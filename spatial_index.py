@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import crud
+from snapshot import VersionedSnapshot
+
+ENABLED = os.getenv("SPATIAL_INDEX_ENABLED", "true").lower() == "true"
+
+
+class GridIndex:
+    """Uniform grid over the Georgia bounding box for nearest-system lookups.
+
+    Distances are planar in degrees, the same metric PostGIS uses for `<->`
+    on SRID 4326 geometries, so results match `crud.get_nearest_systems`.
+    Points outside the box are clamped into the border cells, which keeps
+    the ring search bound valid for queries inside the box.
+    """
+
+    def __init__(self, pwsids, lats, lons, cell_size: float = 0.05):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        self.cell_size = cell_size
+        self._min_lat, self._max_lat = crud.GEORGIA_LAT_RANGE
+        self._min_lon, self._max_lon = crud.GEORGIA_LON_RANGE
+        self._nx = int(np.ceil((self._max_lon - self._min_lon) / cell_size))
+        self._ny = int(np.ceil((self._max_lat - self._min_lat) / cell_size))
+
+        cx, cy = self._cells(lats, lons)
+        cell_ids = cy * self._nx + cx
+        order = np.argsort(cell_ids, kind="stable")
+        self._lats = lats[order]
+        self._lons = lons[order]
+        self._pwsids = np.asarray(pwsids, dtype=object)[order]
+        # Points of cell i live in [offsets[i], offsets[i + 1]).
+        self._offsets = np.searchsorted(cell_ids[order], np.arange(self._nx * self._ny + 1))
+
+    def __len__(self):
+        return len(self._pwsids)
+
+    def _cells(self, lats, lons):
+        cx = np.clip(((lons - self._min_lon) // self.cell_size).astype(np.int64), 0, self._nx - 1)
+        cy = np.clip(((lats - self._min_lat) // self.cell_size).astype(np.int64), 0, self._ny - 1)
+        return cx, cy
+
+    def _ring(self, cx: int, cy: int, ring: int):
+        """Yields the point slices of the cells at Chebyshev distance `ring` from (cx, cy)."""
+        if ring == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = [(x, y) for x in range(cx - ring, cx + ring + 1) for y in (cy - ring, cy + ring)]
+            cells += [(x, y) for y in range(cy - ring + 1, cy + ring) for x in (cx - ring, cx + ring)]
+        for x, y in cells:
+            if 0 <= x < self._nx and 0 <= y < self._ny:
+                cell = y * self._nx + x
+                start, end = self._offsets[cell], self._offsets[cell + 1]
+                if end > start:
+                    yield np.arange(start, end)
+
+    def _ranked(self, candidates, lat: float, lon: float, bound: float, limit: int):
+        distances = np.hypot(self._lons[candidates] - lon, self._lats[candidates] - lat)
+        results, seen = [], set()
+        for i in np.argsort(distances, kind="stable"):
+            if distances[i] > bound:
+                break
+            pwsid = self._pwsids[candidates[i]]
+            if pwsid not in seen:
+                seen.add(pwsid)
+                results.append((pwsid, float(distances[i])))
+                if len(results) == limit:
+                    break
+        return results
+
+    def nearest(self, lat: float, lon: float, limit: int = 1):
+        """Returns up to `limit` (pwsid, distance) pairs for the nearest distinct systems."""
+        if not len(self):
+            return []
+        if not crud.is_in_georgia(lat, lon):
+            return self._ranked(np.arange(len(self)), lat, lon, np.inf, limit)
+
+        cx, cy = (int(c) for c in self._cells(np.float64(lat), np.float64(lon)))
+        chunks = []
+        for ring in range(max(self._nx, self._ny) + 1):
+            chunks.extend(self._ring(cx, cy, ring))
+            if not chunks:
+                continue
+            # Anything outside rings 0..ring is at least ring * cell_size away.
+            results = self._ranked(np.concatenate(chunks), lat, lon, ring * self.cell_size, limit)
+            if len(results) == limit:
+                return results
+        return self._ranked(np.concatenate(chunks), lat, lon, np.inf, limit)
+
+
+def build_from_db(db: Session):
+    points = crud.get_geographic_points(db)
+    return GridIndex(
+        [point[0] for point in points],
+        [point[1] for point in points],
+        [point[2] for point in points],
+    )
+
+
+snapshot = VersionedSnapshot("spatial index", build_from_db)
+
+
+def nearest_pwsid(db: Session, lat: float, lon: float):
+    """Answers from the in-memory index, or returns None so callers fall back to PostGIS."""
+    if not ENABLED:
+        return None
+    index = snapshot.get(db)
+    if index is None:
+        return None
+    nearest = index.nearest(lat, lon, limit=1)
+    return nearest[0][0] if nearest else None
@@ -1,6 +1,9 @@
 -- Enable PostGIS extension
 CREATE EXTENSION IF NOT EXISTS postgis;
 
+-- Enable trigram matching for the system search indexes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Drop tables if they exist to ensure a clean slate
 DROP TABLE IF EXISTS sdwa_violations_enforcement CASCADE;
 DROP TABLE IF EXISTS sdwa_site_visits CASCADE;
@@ -12,6 +15,9 @@ DROP TABLE IF EXISTS sdwa_lcr_samples CASCADE;
 DROP TABLE IF EXISTS sdwa_geographic_areas CASCADE;
 DROP TABLE IF EXISTS sdwa_facilities CASCADE;
 DROP TABLE IF EXISTS sdwa_events_milestones CASCADE;
+DROP TABLE IF EXISTS statistics_rollup CASCADE;
+DROP TABLE IF EXISTS system_status CASCADE;
+DROP TABLE IF EXISTS dataset_version CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
 
 -- Table for Users
@@ -78,6 +84,41 @@ CREATE TABLE sdwa_pub_water_systems (
     seasonal_startup_system VARCHAR(40)
 );
 
+-- Search indexes: trigram GIN for substring/similarity matches on name and
+-- pwsid, and a pattern-ops btree for anchored pwsid prefix lookups
+CREATE INDEX idx_sdwa_pub_water_systems_name_trgm ON sdwa_pub_water_systems USING GIN (pws_name gin_trgm_ops);
+CREATE INDEX idx_sdwa_pub_water_systems_pwsid_trgm ON sdwa_pub_water_systems USING GIN (pwsid gin_trgm_ops);
+CREATE INDEX idx_sdwa_pub_water_systems_pwsid_prefix ON sdwa_pub_water_systems (pwsid varchar_pattern_ops);
+
+-- Zip lookups, keyset-paginated on pwsid
+CREATE INDEX idx_sdwa_pub_water_systems_zip_code ON sdwa_pub_water_systems (zip_code, pwsid);
+
+-- Single-row counter bumped by scripts/ingest_data.py after every load
+CREATE TABLE dataset_version (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Precomputed per-system status, rebuilt by scripts/ingest_data.py
+CREATE TABLE system_status (
+    pwsid VARCHAR(9) PRIMARY KEY,
+    active_violation_count INTEGER NOT NULL DEFAULT 0,
+    last_violation_date DATE,
+    status VARCHAR(10) NOT NULL,
+    refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- System counts per county, type, source, contaminant and quarter, rebuilt on ingest
+CREATE TABLE statistics_rollup (
+    dimension VARCHAR(20) NOT NULL,
+    value VARCHAR(40) NOT NULL,
+    total_systems INTEGER NOT NULL DEFAULT 0,
+    total_systems_with_violations INTEGER NOT NULL DEFAULT 0,
+    active_systems_with_violations INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, value)
+);
+
 -- Table for Geographic Areas
 CREATE TABLE sdwa_geographic_areas (
     submissionyearquarter VARCHAR(7),
@@ -95,6 +136,9 @@ CREATE TABLE sdwa_geographic_areas (
     PRIMARY KEY (pwsid, geo_id)
 );
 
+-- GiST index backing the nearest-system (<->) lookup
+CREATE INDEX idx_sdwa_geographic_areas_geom ON sdwa_geographic_areas USING GIST (geom);
+
 -- Table for Facilities
 CREATE TABLE sdwa_facilities (
     submissionyearquarter VARCHAR(7),
@@ -138,7 +182,7 @@ CREATE TABLE sdwa_violations_enforcement (
     is_major_viol_ind VARCHAR(1),
     severity_ind_cnt VARCHAR(255),
     calculated_rtc_date DATE,
-    violation_status VARCHAR(11),
+    violation_status VARCHAR(20),
     public_notification_tier INTEGER,
     calculated_pub_notif_tier INTEGER,
     viol_originator_code VARCHAR(10),
@@ -158,6 +202,13 @@ CREATE TABLE sdwa_violations_enforcement (
     enf_last_reported_date DATE
 );
 
+-- Per-system violation lookups (also backs the foreign key), keyset-paginated on
+-- violation_id, and a partial index for the open health-based violations that
+-- decide a system's status. The other child tables' primary keys lead with pwsid.
+CREATE INDEX idx_sdwa_violations_enforcement_pwsid ON sdwa_violations_enforcement (pwsid, violation_id);
+CREATE INDEX idx_sdwa_violations_enforcement_active_health_based ON sdwa_violations_enforcement (pwsid)
+    WHERE is_health_based_ind = 'Y' AND non_compl_per_end_date IS NULL;
+
 -- Table for Lead and Copper Rule Samples
 CREATE TABLE sdwa_lcr_samples (
     submissionyearquarter VARCHAR(7),
@@ -223,7 +274,8 @@ CREATE TABLE sdwa_service_areas (
     service_area_type_code VARCHAR(4),
     is_primary_service_area_code VARCHAR(1),
     first_reported_date DATE,
-    last_reported_date DATE
+    last_reported_date DATE,
+    PRIMARY KEY (pwsid, service_area_type_code)
 );
 
 -- Table for Site Visits
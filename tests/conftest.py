@@ -0,0 +1,108 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from geoalchemy2 import WKTElement
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "scripts")]
+
+import cache
+import database
+import models
+
+# The tests run against DATABASE_URL and skip when it can't be reached. Rows
+# they insert live in a transaction that is rolled back, except where a test
+# says otherwise.
+
+
+@pytest.fixture(scope="session")
+def database_available():
+    try:
+        with database.engine.connect() as conn:
+            conn.execute(text("SELECT 1;"))
+    except Exception as e:
+        pytest.skip(f"database unavailable: {str(e).splitlines()[0]}")
+
+def _has_extension(name):
+    with database.engine.connect() as conn:
+        return conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = :name;"), {"name": name}).scalar()
+
+@pytest.fixture(scope="session")
+def postgis(database_available):
+    if not _has_extension("postgis"):
+        pytest.skip("PostGIS is not installed in the test database")
+
+@pytest.fixture(scope="session")
+def pg_trgm(database_available):
+    if not _has_extension("pg_trgm"):
+        pytest.skip("pg_trgm is not installed in the test database")
+
+@pytest.fixture
+def db(database_available):
+    """Session whose work, commits included, is rolled back at the end of the test."""
+    conn = database.engine.connect()
+    transaction = conn.begin()
+    session = Session(bind=conn, autoflush=False, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        conn.close()
+
+@pytest.fixture
+def count_statements():
+    """`with count_statements(engine) as statements:` collects the SQL `engine` executes in the block."""
+    @contextmanager
+    def counting(engine):
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+    return counting
+
+@pytest.fixture
+def client(database_available, monkeypatch):
+    """TestClient on the app, uncached and signed in as a test user."""
+    from fastapi.testclient import TestClient
+    import main
+
+    monkeypatch.setattr(cache, "backend", None)
+    main.app.dependency_overrides[main.get_current_user] = lambda: models.User(username="test", role="admin")
+    try:
+        # One event loop for the whole test, which the async pools' connections are bound to.
+        with TestClient(main.app) as test_client:
+            yield test_client
+            for engine in {database.async_engine, database.async_read_engine}:
+                test_client.portal.call(engine.dispose)
+    finally:
+        main.app.dependency_overrides.clear()
+
+def add_geocoded_systems(db, points, prefix="ZZ"):
+    """Adds a system per (lat, lon) in `points`, with pwsids starting with `prefix`, and returns the pwsids."""
+    pwsids = [f"{prefix}{i:07d}" for i in range(len(points))]
+    db.add_all(
+        models.PublicWaterSystem(pwsid=pwsid, pws_name=f"Test System {i}", zip_code="00000")
+        for i, pwsid in enumerate(pwsids)
+    )
+    # Flushed apart: the areas reference the systems and the models don't say so.
+    db.flush()
+    db.add_all(
+        models.GeographicArea(pwsid=pwsid, geo_id=f"TEST{i}", geom=WKTElement(f"POINT({lon} {lat})", srid=4326))
+        for i, (pwsid, (lat, lon)) in enumerate(zip(pwsids, points))
+    )
+    db.flush()
+    return pwsids
+
+def add_active_violation(db, pwsid, violation_id="TEST0"):
+    """Adds an open health-based violation, which makes `pwsid` "not safe"."""
+    db.add(models.Violation(violation_id=violation_id, pwsid=pwsid, is_health_based_ind="Y"))
+    db.flush()
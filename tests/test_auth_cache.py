@@ -0,0 +1,123 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import auth_cache
+import crud
+import database
+import models
+import schemas
+from auth_cache import PrincipalCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # auth_cache.time is the time module itself; monkeypatch restores it after the test.
+    monkeypatch.setattr(auth_cache.time, "time", clock.time)
+    return clock
+
+def user(username="zz-test-user"):
+    return models.User(username=username, role="Operator")
+
+def test_entries_expire_with_the_token_or_the_ttl_whichever_is_first(clock):
+    cache = PrincipalCache(ttl=60)
+    cache.set("short-lived", user(), expires_at=clock.now + 10)
+    cache.set("long-lived", user(), expires_at=clock.now + 600)
+    cache.set("no-exp", user())
+    cache.set("expired", user(), expires_at=clock.now)
+
+    clock.now += 9.9
+    assert cache.get("short-lived") is not None
+    assert cache.get("expired") is None
+    clock.now += 0.1
+    assert cache.get("short-lived") is None
+    assert cache.get("long-lived") is not None
+
+    clock.now += 49.9
+    assert cache.get("long-lived") is not None and cache.get("no-exp") is not None
+    clock.now += 0.1
+    assert cache.get("long-lived") is None and cache.get("no-exp") is None
+    assert cache.stats()["entries"] == 0
+
+def test_lru_eviction_keeps_the_recently_used_within_the_bound(clock):
+    cache = PrincipalCache(max_entries=2)
+    cache.set("a", user("zz-a"))
+    cache.set("b", user("zz-b"))
+    assert cache.get("a") is not None
+    cache.set("c", user("zz-c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["entries"] == 2
+    # The evicted token is no longer indexed under its user either.
+    assert "zz-b" not in cache._tokens_by_username
+
+def test_creating_a_user_evicts_every_cached_token_of_that_user(db, monkeypatch):
+    monkeypatch.setattr(auth_cache, "principals", PrincipalCache())
+    for token in ("first", "second"):
+        auth_cache.principals.set(token, user("zz-test-user"))
+    auth_cache.principals.set("other", user("zz-other-user"))
+
+    crud.create_user(db, schemas.UserCreate(username="zz-test-user", password="secret", role="Operator"))
+
+    assert auth_cache.principals.get("first") is None
+    assert auth_cache.principals.get("second") is None
+    assert auth_cache.principals.get("other") is not None
+
+def current_user(token, add_user=False):
+    """Runs main.get_current_user for `token` in a rolled-back transaction, with zz-test-user in it if `add_user`."""
+    import main
+
+    async def run():
+        try:
+            async with database.async_engine.connect() as conn:
+                transaction = await conn.begin()
+                session = AsyncSession(bind=conn)
+                try:
+                    if add_user:
+                        session.add(models.User(username="zz-test-user", hashed_password="-", role="Operator"))
+                        await session.flush()
+                    return await main.get_current_user(token=token, db=session)
+                finally:
+                    await session.close()
+                    await transaction.rollback()
+        finally:
+            await database.async_engine.dispose()
+    return asyncio.run(run())
+
+def test_verified_tokens_are_served_from_the_cache(database_available, monkeypatch):
+    import main
+
+    monkeypatch.setattr(auth_cache, "principals", PrincipalCache())
+    token = main.create_access_token({"sub": "zz-test-user"}, expires_delta=timedelta(minutes=5))
+    assert current_user(token, add_user=True).username == "zz-test-user"
+    # The user only existed in the rolled-back transaction: this one is a cache hit.
+    assert current_user(token).username == "zz-test-user"
+    assert auth_cache.principals.stats()["hits"] == 1
+
+@pytest.mark.parametrize("kind", ["expired", "undecodable"])
+def test_bad_tokens_are_never_cached(database_available, monkeypatch, kind):
+    import main
+
+    monkeypatch.setattr(auth_cache, "principals", PrincipalCache())
+    if kind == "expired":
+        token = main.create_access_token({"sub": "zz-test-user"}, expires_delta=timedelta(seconds=-1))
+    else:
+        token = "not-a-jwt"
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as error:
+            current_user(token, add_user=True)
+        assert error.value.status_code == 401
+    assert auth_cache.principals.stats() == {"entries": 0, "hits": 0, "misses": 2, "hit_rate": 0.0}
@@ -0,0 +1,80 @@
+import crud
+from autocomplete import MAX_LIMIT, PRECOMPUTED_PREFIX_LENGTH, PrefixIndex
+from snapshot import VersionedSnapshot
+
+
+def system(pwsid, name, population, city=None, zip_code=None):
+    return {
+        "pwsid": pwsid, "pws_name": name, "city_name": city, "zip_code": zip_code,
+        "population_served_count": population,
+    }
+
+SYSTEMS = [
+    system("GA0000001", "City of Atlanta", 500000, city="Atlanta", zip_code="30303-1234"),
+    system("GA0000002", "Atlanta Heights Water", 2000, city="Decatur", zip_code="30030"),
+    system("GA0000003", "Athens Clarke County", 120000, city="Athens", zip_code="30601"),
+    system("GA0000004", "Augusta Utilities", None, city="Augusta", zip_code="30901"),
+]
+
+def pwsids(systems):
+    return [s["pwsid"] for s in systems]
+
+def test_matches_any_word_of_the_name_city_zip_or_pwsid():
+    index = PrefixIndex(SYSTEMS)
+    assert pwsids(index.lookup("heights")) == ["GA0000002"]
+    assert pwsids(index.lookup("decatur")) == ["GA0000002"]
+    assert pwsids(index.lookup("30303")) == ["GA0000001"]
+    assert pwsids(index.lookup("ga0000004")) == ["GA0000004"]
+    # Zip codes are keyed on their first five digits only.
+    assert index.lookup("30303-1") == []
+    assert index.lookup("nowhere") == []
+    assert index.lookup("  ") == []
+
+def test_ranks_by_population_served():
+    index = PrefixIndex(SYSTEMS)
+    assert pwsids(index.lookup("atlanta")) == ["GA0000001", "GA0000002"]
+    # Unknown population ranks last, ties by pwsid.
+    assert pwsids(index.lookup("a")) == ["GA0000001", "GA0000003", "GA0000002", "GA0000004"]
+    assert pwsids(index.lookup("ATLANTA  Heights")) == ["GA0000002"]
+
+def test_precomputed_short_prefixes_agree_with_the_full_scan():
+    index = PrefixIndex(SYSTEMS)
+    for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 2):
+        for prefix in {key[:length] for key in index._keys}:
+            expected = index._top_ranks(prefix, 10)
+            assert pwsids(index.lookup(prefix)) == [index._systems[rank]["pwsid"] for rank in expected]
+    assert "atla" not in index._precomputed
+    assert "atl" in index._precomputed
+
+def test_limit_is_applied_and_capped():
+    many = [system(f"GA{i:07d}", f"Lake System {i}", i) for i in range(MAX_LIMIT + 10)]
+    index = PrefixIndex(many)
+    for query in ("la", "lake sys"):
+        assert len(index.lookup(query, limit=3)) == 3
+        assert len(index.lookup(query, limit=MAX_LIMIT + 5)) == MAX_LIMIT
+        assert index.lookup(query, limit=3)[0]["pwsid"] == f"GA{MAX_LIMIT + 9:07d}"
+
+def test_snapshot_serves_the_old_value_until_refreshed(monkeypatch):
+    version = {"current": 1}
+    monkeypatch.setattr(crud, "get_dataset_version", lambda db: version["current"])
+    builds = []
+    snapshot = VersionedSnapshot("test index", lambda db: builds.append(version["current"]) or version["current"])
+
+    assert snapshot.get(None) == 1
+    version["current"] = 2
+    # A version bump doesn't rebuild on the request path.
+    assert snapshot.get(None) == 1
+    snapshot.refresh(None, 2)
+    assert snapshot.get(None) == 2
+    snapshot.refresh(None, 2)
+    assert builds == [1, 2]
+
+def test_failed_refresh_keeps_the_previous_snapshot(monkeypatch):
+    monkeypatch.setattr(crud, "get_dataset_version", lambda db: 1)
+    values = iter([["built"]])
+    snapshot = VersionedSnapshot("test index", lambda db: next(values))
+
+    assert snapshot.get(None) == ["built"]
+    snapshot.refresh(None, 2)
+    assert snapshot.get(None) == ["built"]
+    assert snapshot.version == 1
@@ -0,0 +1,22 @@
+import pytest
+from pydantic import ValidationError
+
+import schemas
+
+
+def test_batch_request_is_limited_per_list():
+    limit = schemas.MAX_BATCH_SIZE
+    schemas.BatchLookupRequest(pwsids=["GA0000000"] * limit, points=[{"lat": 33.7, "lon": -84.4}] * limit)
+    with pytest.raises(ValidationError):
+        schemas.BatchLookupRequest(pwsids=["GA0000000"] * (limit + 1))
+    with pytest.raises(ValidationError):
+        schemas.BatchLookupRequest(points=[{"lat": 33.7, "lon": -84.4}] * (limit + 1))
+
+def test_batch_endpoint(client):
+    too_many = {"pwsids": [f"GA{i:07d}" for i in range(schemas.MAX_BATCH_SIZE + 1)]}
+    assert client.post("/systems/batch", json=too_many).status_code == 422
+
+    response = client.post("/systems/batch", json={"pwsids": ["GA0000000"], "points": [{"lat": 0.0, "lon": 0.0}]})
+    assert response.status_code == 200
+    assert response.json()["not_found"] == ["GA0000000"]
+    assert response.json()["points"] == [{"lat": 0.0, "lon": 0.0, "pwsid": None}]
@@ -0,0 +1,69 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import Request
+
+import cache
+
+
+def get(endpoint, compute, **kwargs):
+    return asyncio.run(cache.cached_json(endpoint, compute, **kwargs))
+
+def test_a_change_between_ingests_reaches_every_worker(monkeypatch):
+    monkeypatch.setattr(cache, "dataset_version", 1)
+    monkeypatch.setattr(cache, "dataset_updated_at", datetime(2024, 1, 1, tzinfo=timezone.utc))
+    # Shared state, like system_status.refreshed_at, read by each worker on its request.
+    state = {"status": "not safe", "refreshed_at": datetime(2024, 1, 1, 0, 5, tzinfo=timezone.utc)}
+    workers = [cache.MemoryBackend(), cache.MemoryBackend()]
+
+    def read_all():
+        responses = []
+        for worker in workers:
+            monkeypatch.setattr(cache, "backend", worker)
+            responses.append(get(
+                "system_status", lambda: state["status"], changed_at=lambda: state["refreshed_at"], pwsid="GA0000001"
+            ))
+        return responses
+
+    assert [response.body for response in read_all()] == [b'"not safe"'] * 2
+    # An acknowledgement handled by some other worker.
+    state["status"] = "safe"
+    state["refreshed_at"] += timedelta(minutes=1)
+    responses = read_all()
+    assert [response.body for response in responses] == [b'"safe"'] * 2
+    assert responses[0].headers["Last-Modified"] == "Mon, 01 Jan 2024 00:06:00 GMT"
+
+def conditional(etag):
+    return Request({"type": "http", "method": "GET", "headers": [(b"if-none-match", etag.encode())]})
+
+def test_etag_revalidates_against_the_body_it_was_served_with(monkeypatch):
+    monkeypatch.setattr(cache, "dataset_version", 1)
+    monkeypatch.setattr(cache, "backend", cache.MemoryBackend())
+    body = {"count": 1}
+    etag = get("statistics", lambda: body).headers["ETag"]
+
+    response = get("statistics", lambda: body, request=conditional(etag))
+    assert response.status_code == 304
+
+    # Same key, different body, e.g. recomputed after an eviction or on another worker.
+    body = {"count": 2}
+    monkeypatch.setattr(cache, "backend", cache.MemoryBackend())
+    response = get("statistics", lambda: body, request=conditional(etag))
+    assert response.status_code == 200
+    assert response.body == b'{"count":2}'
+    assert response.headers["ETag"] != etag
+
+def test_fast_encoding_parses_to_the_validated_encoding():
+    value = {"pwsid": "GA0000001", "floats": [1e-05, 1e16, 0.1, -0.0], "count": 3, "name": "Café"}
+    assert json.loads(cache.encode_fast(value)) == json.loads(cache.encode(value))
+
+def test_fast_encoding_of_non_finite_floats():
+    with pytest.raises(ValueError):
+        cache.encode(float("nan"))
+    if cache.orjson is not None:
+        assert cache.encode_fast([float("nan"), float("inf")]) == b"[null,null]"
+    else:
+        with pytest.raises(ValueError):
+            cache.encode_fast(float("nan"))
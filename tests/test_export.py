@@ -0,0 +1,31 @@
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import database
+
+
+def test_export_requires_a_token(database_available):
+    import main
+    response = TestClient(main.app).get("/export/sdwa_ref_code_values")
+    assert response.status_code == 401
+
+def test_export_streams_every_row_on_the_export_pool(client):
+    with database.engine.connect() as conn:
+        total = conn.execute(text("SELECT count(*) FROM sdwa_ref_code_values;")).scalar()
+
+    response = client.get("/export/sdwa_ref_code_values")
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == total
+
+    response = client.get("/export/sdwa_ref_code_values", params={"format": "csv"})
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == total + 1
+    # Streamed over the export pool, and the connection went back to it.
+    assert database.export_engine.pool.checkedin() >= 1
+    assert database.export_engine.pool.checkedout() == 0
+
+def test_export_rejects_unknown_tables(client):
+    assert client.get("/export/users").status_code == 404
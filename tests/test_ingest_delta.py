@@ -0,0 +1,45 @@
+import pytest
+
+import database
+import ingest_data
+
+HEADER = "PWSID,SERVICE_AREA_TYPE_CODE,IS_PRIMARY_SERVICE_AREA_CODE,LAST_REPORTED_DATE\n"
+
+
+@pytest.fixture
+def conn(database_available):
+    """A raw connection whose work is rolled back at the end of the test."""
+    raw = database.engine.raw_connection()
+    try:
+        yield raw
+    finally:
+        raw.rollback()
+        raw.close()
+
+def upsert_extract(cur, tmp_path, rows):
+    path = tmp_path / "SDWA_SERVICE_AREAS.csv"
+    path.write_text(HEADER + "".join(f"{','.join(row)}\n" for row in rows))
+    stage, columns = ingest_data.stage_table(cur, str(path), "sdwa_service_areas")
+    written = ingest_data.upsert_from_stage(cur, "sdwa_service_areas", stage, columns)
+    cur.execute(f"DROP TABLE {stage};")
+    return written
+
+def test_delta_upserts_only_new_and_changed_rows(conn, tmp_path):
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO sdwa_pub_water_systems (pwsid) VALUES ('ZZ0000000');")
+        rows = [("ZZ0000000", "RS", "Y", "01/01/2020"), ("ZZ0000000", "SC", "N", "01/01/2020")]
+        assert upsert_extract(cur, tmp_path, rows) == 2
+
+        # Same rows: nothing to write. A newer last_reported_date updates the row in place.
+        assert upsert_extract(cur, tmp_path, rows) == 0
+        assert upsert_extract(cur, tmp_path, [rows[0], ("ZZ0000000", "SC", "Y", "04/01/2020")]) == 1
+
+        cur.execute("""
+            SELECT service_area_type_code, is_primary_service_area_code, last_reported_date::text
+            FROM sdwa_service_areas WHERE pwsid = 'ZZ0000000' ORDER BY 1;
+        """)
+        assert cur.fetchall() == [("RS", "Y", "2020-01-01"), ("SC", "Y", "2020-04-01")]
+
+def test_failed_delta_is_rolled_back_and_raised(conn, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ingest_data.delta_ingest(conn, [(str(tmp_path / "missing.csv"), "sdwa_service_areas")])
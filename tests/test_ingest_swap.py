@@ -0,0 +1,64 @@
+import os
+import threading
+
+import pytest
+from sqlalchemy import text
+
+import database
+import ingest_data
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# Replaces every table in DATABASE_URL with the extracts in data/, so only
+# runs when asked to, against a database that can be thrown away.
+pytestmark = pytest.mark.skipif(
+    os.getenv("RELOAD_TEST_DATABASE") != "1",
+    reason="reloads DATABASE_URL from data/; set RELOAD_TEST_DATABASE=1 to run it"
+)
+
+
+def ingest_jobs():
+    jobs = [
+        (os.path.join(DATA_DIR, file_name), table_name)
+        for file_name, table_name in ingest_data.FILE_TO_TABLE_MAP.items()
+        if os.path.exists(os.path.join(DATA_DIR, file_name))
+    ]
+    if not jobs:
+        pytest.skip(f"no extracts in {DATA_DIR}")
+    return jobs
+
+def scalar(sql):
+    with database.engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+def test_reads_stay_complete_during_a_full_reload(client, monkeypatch):
+    """Reloads the database from data/ while reading from it; it ends up with the same rows."""
+    jobs = ingest_jobs()
+    url = database.engine.url
+    monkeypatch.setattr(ingest_data, "DB_PARAMS", {**url.translate_connect_args(username="user"), **url.query})
+    pwsid = scalar("""
+        SELECT pwsid FROM sdwa_violations_enforcement GROUP BY pwsid ORDER BY count(*) DESC LIMIT 1;
+    """)
+    if pwsid is None:
+        pytest.skip("the database has no violations to read")
+    version = scalar("SELECT version FROM dataset_version WHERE id = 1;") or 0
+
+    reload = threading.Thread(target=ingest_data.full_ingest, args=(jobs,))
+    reload.start()
+    reads, failures = 0, []
+    while reload.is_alive() or reads == 0:
+        for path in ("/statistics", f"/systems/by-id/{pwsid}", f"/api/systems/{pwsid}/history"):
+            response = client.get(path)
+            reads += 1
+            if response.status_code != 200:
+                failures.append(f"{path}: {response.status_code} {response.text[:200]}")
+                continue
+            body = response.json()
+            if not (body.get("total_systems") if path == "/statistics" else
+                    body.get("pwsid") == pwsid if "by-id" in path else
+                    body.get("violations")):
+                failures.append(f"{path}: empty or wrong result {response.text[:200]}")
+    reload.join()
+
+    assert not failures, f"{len(failures)} of {reads} reads failed, first: {failures[0]}"
+    assert scalar("SELECT version FROM dataset_version WHERE id = 1;") == version + 1, "the reload did not swap"
@@ -0,0 +1,28 @@
+import crud
+import database
+import models
+from conftest import add_active_violation, add_geocoded_systems
+
+
+def test_map_overview_is_one_statement_whatever_the_number_of_systems(db, postgis, count_statements):
+    counts = []
+    for batch, prefix in ((3, "ZA"), (30, "ZB")):
+        pwsids = add_geocoded_systems(db, [(30.0, -60.0)] * batch, prefix=prefix)
+        with count_statements(database.engine) as statements:
+            overview = crud.get_map_overview(db)
+        counts.append(len(statements))
+        returned = {system["pwsid"]: system for system in overview}
+        assert set(pwsids) <= set(returned)
+        assert returned[pwsids[0]]["geom"].startswith("POINT(")
+        assert returned[pwsids[0]]["status"] == crud.status_from_count(0)
+    assert counts == [1, 1]
+
+def test_systems_without_a_status_row_are_counted_live(db, postgis):
+    # As before the first ingest: nothing materialized yet.
+    db.query(models.SystemStatus).delete()
+    violating, clean = add_geocoded_systems(db, [(30.0, -60.0)] * 2)
+    add_active_violation(db, violating)
+
+    statuses = {system["pwsid"]: system["status"] for system in crud.get_map_overview(db)}
+    assert statuses[violating] == crud.status_from_count(1)
+    assert statuses[clean] == crud.status_from_count(0)
@@ -0,0 +1,40 @@
+import pytest
+
+import check_query_plans as plans
+import database
+
+# Checks whose queries call extension functions, by the fixture that skips without it.
+REQUIRES = {
+    "get_pws_by_name": "pg_trgm",
+    "search_systems (zip)": "pg_trgm",
+    "search_systems (pwsid prefix)": "pg_trgm",
+    "search_systems (name)": "pg_trgm",
+    "get_nearest_systems": "postgis",
+    "get_nearest_systems (max distance)": "postgis",
+    "get_nearest_pwsids (max distance)": "postgis",
+    "get_nearest_pwsids_for_points": "postgis",
+}
+
+
+@pytest.fixture(scope="module")
+def sample(database_available):
+    with database.SessionLocal() as db:
+        return plans.sample_row(db)
+
+def check_requirements(request, name):
+    if name in REQUIRES:
+        request.getfixturevalue(REQUIRES[name])
+
+@pytest.mark.parametrize("name", plans.CHECKS)
+def test_query_uses_indexes(request, sample, name):
+    check_requirements(request, name)
+    count, scans = plans.check_plans(plans.CHECKS[name], sample)
+    assert count
+    assert not scans
+
+@pytest.mark.parametrize("name", plans.ASYNC_CHECKS)
+def test_async_query_uses_indexes(request, sample, name):
+    check_requirements(request, name)
+    count, scans = plans.check_async_plans(plans.ASYNC_CHECKS[name], sample)
+    assert count
+    assert not scans
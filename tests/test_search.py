@@ -0,0 +1,63 @@
+from sqlalchemy import text
+
+import crud
+import database
+import models
+
+
+def sample_name_word():
+    with database.engine.connect() as conn:
+        name = conn.execute(text("SELECT pws_name FROM sdwa_pub_water_systems WHERE pws_name <> '' LIMIT 1;")).scalar()
+    return name.split()[0] if name else None
+
+def add_systems(db, systems):
+    """Adds (pwsid, pws_name, zip_code) systems, in the given order."""
+    db.add_all(models.PublicWaterSystem(pwsid=pwsid, pws_name=name, zip_code=zip_code) for pwsid, name, zip_code in systems)
+    db.flush()
+
+def pwsids(page):
+    return [system.pwsid for system in page.items]
+
+def test_zip_search_lists_the_systems_in_that_zip_by_pwsid(db, pg_trgm):
+    add_systems(db, [
+        ("ZZ0000003", "Test Zip C", "00009"),
+        ("ZZ0000001", "Test Zip A", "00009"),
+        ("ZZ0000002", "Test Zip B", "00008"),
+        ("ZZ0000004", "Test Zip D", "00009-1234"),
+    ])
+    assert pwsids(crud.search_systems(db, " 00009 ")) == ["ZZ0000001", "ZZ0000003"]
+
+def test_pwsid_prefix_search_is_anchored_and_case_insensitive(db, pg_trgm):
+    add_systems(db, [
+        ("ZZ0000101", "Test Prefix B", None),
+        ("ZZ0000100", "Test Prefix A", None),
+        ("ZZ0000200", "Test Prefix C", None),
+        ("ZY0000100", "Test Prefix D", None),
+    ])
+    assert pwsids(crud.search_systems(db, "zz00001")) == ["ZZ0000100", "ZZ0000101"]
+    assert pwsids(crud.search_systems(db, "ZZ000020")) == ["ZZ0000200"]
+
+def test_name_search_ranks_by_similarity(db, pg_trgm):
+    add_systems(db, [
+        ("ZZ0000001", "North Qwzx Springs Water Authority", None),
+        ("ZZ0000002", "Qwzx Springs Water", None),
+        ("ZZ0000003", "Qwzx Springs", None),
+        ("ZZ0000004", "Qwzx Sprngs", None),
+        ("ZZ0000005", "Qwzx Springs Water", None),
+    ])
+    # Closest names first, equally close ones by pwsid; names without the query don't match.
+    expected = ["ZZ0000003", "ZZ0000002", "ZZ0000005", "ZZ0000001"]
+    assert pwsids(crud.search_systems(db, "qwzx springs")) == expected
+    assert pwsids(crud.get_pws_by_name(db, "qwzx springs")) == expected
+    assert pwsids(crud.get_pws_by_name(db, "qwzx springs", limit=2)) == expected[:2]
+
+def test_name_lookups_rank_with_trigrams(client, pg_trgm):
+    word = sample_name_word()
+    if word is None:
+        return
+    for response in (client.get(f"/systems/by-name/{word}"), client.get("/systems/search", params={"query": word})):
+        assert response.status_code == 200, response.url
+        systems = response.json()
+        assert systems, response.url
+        # /search also matches pwsids.
+        assert all(word.lower() in f"{s['pws_name']} {s['pwsid']}".lower() for s in systems), response.url
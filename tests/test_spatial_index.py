@@ -0,0 +1,40 @@
+import math
+import random
+
+import pytest
+
+import crud
+import spatial_index
+from check_spatial_index import postgis_nearest
+from conftest import add_geocoded_systems
+from spatial_index import GridIndex
+
+
+def random_point(rng):
+    return rng.uniform(*crud.GEORGIA_LAT_RANGE), rng.uniform(*crud.GEORGIA_LON_RANGE)
+
+def test_grid_index_matches_brute_force():
+    rng = random.Random(4)
+    points = [random_point(rng) for _ in range(500)]
+    # A few systems just outside the box land in the clamped border cells.
+    points += [(29.9, -84.0), (35.4, -83.0), (32.0, -80.5)]
+    pwsids = [f"GA{i:07d}" for i in range(len(points))]
+    index = GridIndex(pwsids, [p[0] for p in points], [p[1] for p in points])
+
+    for _ in range(300):
+        lat, lon = random_point(rng)
+        expected = sorted(math.hypot(p[1] - lon, p[0] - lat) for p in points)[:3]
+        assert [distance for _, distance in index.nearest(lat, lon, limit=3)] == pytest.approx(expected)
+
+def test_grid_index_agrees_with_postgis(db, postgis):
+    rng = random.Random(4)
+    add_geocoded_systems(db, [random_point(rng) for _ in range(200)])
+    index = spatial_index.build_from_db(db)
+
+    with db.connection().connection.cursor() as cur:
+        for _ in range(200):
+            lat, lon = random_point(rng)
+            (pwsid, distance), = index.nearest(lat, lon)
+            expected_pwsid, expected_distance = postgis_nearest(cur, lat, lon)
+            # Equidistant areas may legitimately come back in either order.
+            assert pwsid == expected_pwsid or abs(distance - expected_distance) <= 1e-9
@@ -0,0 +1,172 @@
+import asyncio
+from collections import defaultdict
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud
+import database
+import ingest_data
+import models
+
+KEYS = async_crud.STATISTICS_KEYS
+
+
+def add_statistics_systems(db):
+    """Three test systems, with source codes, a county, contaminants and quarters no real system has."""
+    db.add_all([
+        models.PublicWaterSystem(pwsid="ZZ0000000", pws_type_code="ZZTYP", gw_sw_code="ZZ"),
+        models.PublicWaterSystem(pwsid="ZZ0000001", pws_type_code="ZZTYP", gw_sw_code="ZZ"),
+        models.PublicWaterSystem(pwsid="ZZ0000002", pws_type_code="ZZTYP", gw_sw_code="ZY"),
+    ])
+    db.flush()
+    # Without geometries, so without PostGIS functions around the insert.
+    db.execute(text("""
+        INSERT INTO sdwa_geographic_areas (pwsid, geo_id, county_served)
+        VALUES ('ZZ0000000', 'TEST0', 'ZZ County'), ('ZZ0000001', 'TEST1', 'ZZ County'),
+               ('ZZ0000001', 'TEST2', 'ZZ County');
+    """))
+    db.add_all([
+        # Active, health-based.
+        models.Violation(violation_id="ZZTEST0", pwsid="ZZ0000000", contaminant_code="ZZ01",
+                         is_health_based_ind="Y", non_compl_per_begin_date=date(1901, 2, 1)),
+        # Not health-based.
+        models.Violation(violation_id="ZZTEST1", pwsid="ZZ0000001", contaminant_code="ZZ01",
+                         is_health_based_ind="N", non_compl_per_begin_date=date(1901, 5, 1)),
+        # Health-based, resolved.
+        models.Violation(violation_id="ZZTEST2", pwsid="ZZ0000001", contaminant_code="ZZ02",
+                         is_health_based_ind="Y", non_compl_per_begin_date=date(1901, 5, 1),
+                         non_compl_per_end_date=date(1901, 6, 1)),
+    ])
+    db.flush()
+
+def refresh_rollup(db):
+    # One statement at a time: asyncpg prepares what it runs.
+    for statement in ingest_data.REFRESH_STATISTICS_ROLLUP_SQL.split(";"):
+        if statement.strip():
+            db.execute(text(statement))
+
+def rollup(db):
+    return {
+        (row.dimension, row.value): tuple(getattr(row, key) for key in KEYS)
+        for row in db.scalars(select(models.StatisticsRollup))
+    }
+
+def counted_in_python(db):
+    """What the rollup should hold, counted row by row from the raw tables."""
+    health_based = {pwsid for pwsid, in db.execute(text(
+        "SELECT pwsid FROM sdwa_violations_enforcement WHERE is_health_based_ind = 'Y';"
+    ))}
+    active = {pwsid for pwsid, in db.execute(text("""
+        SELECT pwsid FROM sdwa_violations_enforcement
+        WHERE is_health_based_ind = 'Y' AND non_compl_per_end_date IS NULL;
+    """))}
+    groups = defaultdict(lambda: (set(), set(), set()))
+
+    def add(key, pwsid, is_health_based, is_active):
+        totals, with_violations, with_active = groups[key]
+        totals.add(pwsid)
+        if is_health_based:
+            with_violations.add(pwsid)
+        if is_active:
+            with_active.add(pwsid)
+
+    groups[("all", "")]
+    for pwsid, pws_type_code, gw_sw_code in db.execute(text(
+        "SELECT pwsid, pws_type_code, gw_sw_code FROM sdwa_pub_water_systems;"
+    )):
+        for key in (("all", ""), ("pws_type_code", pws_type_code), ("gw_sw_code", gw_sw_code)):
+            if key[1] is not None:
+                add(key, pwsid, pwsid in health_based, pwsid in active)
+    for pwsid, county in db.execute(text(
+        "SELECT DISTINCT pwsid, county_served FROM sdwa_geographic_areas WHERE county_served IS NOT NULL;"
+    )):
+        add(("county", county), pwsid, pwsid in health_based, pwsid in active)
+    # Contaminants and quarters count the violations in their slice only.
+    for pwsid, contaminant, begin, indicator, end in db.execute(text("""
+        SELECT pwsid, contaminant_code, non_compl_per_begin_date, is_health_based_ind, non_compl_per_end_date
+        FROM sdwa_violations_enforcement;
+    """)):
+        is_health_based = indicator == "Y"
+        is_active = is_health_based and end is None
+        if contaminant is not None:
+            add(("contaminant", contaminant), pwsid, is_health_based, is_active)
+        if begin is not None:
+            add(("quarter", f"{begin.year}Q{(begin.month - 1) // 3 + 1}"), pwsid, is_health_based, is_active)
+    return {key: tuple(len(pwsids) for pwsids in sets) for key, sets in groups.items()}
+
+def test_rollup_matches_counts_from_the_raw_tables(db):
+    add_statistics_systems(db)
+    db.connection().exec_driver_sql(ingest_data.REFRESH_STATISTICS_ROLLUP_SQL)
+
+    built = rollup(db)
+    assert built == counted_in_python(db)
+    assert built[("gw_sw_code", "ZZ")] == (2, 2, 1)
+    assert built[("county", "ZZ County")] == (2, 2, 1)
+    assert built[("contaminant", "ZZ01")] == (2, 1, 1)
+    assert built[("quarter", "1901Q2")] == (1, 1, 0)
+
+def with_statistics(query, built):
+    """Runs `await query(session)` over the test systems in a rolled-back transaction; returns (result, rollup).
+
+    Without `built`, the rollup table is emptied first, as before the first ingest.
+    """
+    def prepare(db):
+        add_statistics_systems(db)
+        refresh_rollup(db)
+        expected = rollup(db)
+        if not built:
+            db.execute(text("DELETE FROM statistics_rollup;"))
+        return expected
+
+    async def run():
+        try:
+            async with database.async_engine.connect() as conn:
+                transaction = await conn.begin()
+                session = AsyncSession(bind=conn)
+                try:
+                    expected = await session.run_sync(prepare)
+                    try:
+                        return await query(session), expected
+                    except HTTPException as e:
+                        return e, expected
+                finally:
+                    await session.close()
+                    await transaction.rollback()
+        finally:
+            await database.async_engine.dispose()
+    return asyncio.run(run())
+
+def counts(values):
+    return dict(zip(KEYS, values))
+
+@pytest.mark.parametrize("built", [True, False], ids=["rollup", "before the first rollup"])
+def test_statistics_variants(database_available, built):
+    statewide, expected = with_statistics(lambda db: async_crud.get_system_statistics(db), built)
+    assert statewide == counts(expected[("all", "")])
+
+    filtered, _ = with_statistics(
+        lambda db: async_crud.get_system_statistics(db, filters={"gw_sw_code": "ZZ", "county": None}), built
+    )
+    assert filtered == {"gw_sw_code": "ZZ", **counts(expected[("gw_sw_code", "ZZ")])}
+
+    breakdown, _ = with_statistics(lambda db: async_crud.get_system_statistics(db, breakdown="contaminant"), built)
+    assert breakdown["breakdown"] == "contaminant"
+    # Ordered by the database's collation.
+    assert sorted(breakdown["rows"], key=lambda row: row["contaminant"]) == [
+        {"contaminant": value, **counts(values)}
+        for (dimension, value), values in sorted(expected.items()) if dimension == "contaminant"
+    ]
+    assert {"contaminant": "ZZ02", **counts((1, 1, 0))} in breakdown["rows"]
+
+    unknown, _ = with_statistics(lambda db: async_crud.get_system_statistics(db, filters={"county": "No Such"}), built)
+    assert isinstance(unknown, HTTPException) and unknown.status_code == 404
+
+def test_statistics_take_one_dimension_at_a_time(client):
+    assert client.get("/statistics", params={"county": "Fulton", "gw_sw_code": "GW"}).status_code == 400
+    assert client.get("/statistics", params={"county": "Fulton", "breakdown": "quarter"}).status_code == 400
+    assert client.get("/statistics", params={"breakdown": "owner"}).status_code == 400
+    assert client.get("/statistics", params={"breakdown": "quarter"}).status_code == 200
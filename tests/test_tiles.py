@@ -0,0 +1,97 @@
+import asyncio
+import math
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+import models
+import tiles
+from conftest import add_active_violation, add_geocoded_systems
+
+
+def tile_of(lat, lon, z):
+    """The x/y of the zoom `z` web-mercator tile holding (lat, lon)."""
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+def with_systems(points, query, prepare=None):
+    """Adds a system per point in a rolled-back transaction and returns (await query(session), pwsids).
+
+    `prepare(db, pwsids)`, if given, runs on the sync session before the query.
+    """
+    def add(db):
+        pwsids = add_geocoded_systems(db, points)
+        if prepare is not None:
+            prepare(db, pwsids)
+        return pwsids
+
+    async def run():
+        try:
+            async with database.async_engine.connect() as conn:
+                transaction = await conn.begin()
+                session = AsyncSession(bind=conn)
+                try:
+                    pwsids = await session.run_sync(add)
+                    return await query(session), pwsids
+                finally:
+                    await session.close()
+                    await transaction.rollback()
+        finally:
+            await database.async_engine.dispose()
+    return asyncio.run(run())
+
+def test_tile_encodes_the_systems_in_it(postgis):
+    z = 10
+    x, y = tile_of(30.0, -60.0, z)
+    tile, pwsids = with_systems([(30.0, -60.0)], lambda db: tiles.get_tile(db, z, x, y))
+    assert b"systems" in tile
+    assert pwsids[0].encode() in tile
+
+    neighbour, pwsids = with_systems([(30.0, -60.0)], lambda db: tiles.get_tile(db, z, x + 2, y))
+    assert pwsids[0].encode() not in neighbour
+
+def test_clusters_merge_nearby_systems(postgis):
+    z = 4
+    x, y = tile_of(30.0, -60.0, z)
+    # Three systems on one spot and one a third of the way across the tile, in another grid cell.
+    clusters, pwsids = with_systems(
+        [(30.0, -60.0)] * 3 + [(30.0, -52.0)], lambda db: tiles.get_tile_clusters(db, z, x, y)
+    )
+    properties = sorted(
+        (feature["properties"] for feature in clusters["features"]
+         if feature["properties"]["pwsid"] in (None, pwsids[3])),
+        key=lambda p: p["system_count"]
+    )
+    assert {"system_count": 1, "not_safe_count": 0, "pwsid": pwsids[3]} in properties
+    assert any(p["system_count"] >= 3 and p["pwsid"] is None for p in properties)
+
+def test_clusters_count_systems_without_a_status_row_live(postgis):
+    z = 10
+    x, y = tile_of(30.0, -60.0, z)
+
+    def before_first_ingest(db, pwsids):
+        db.query(models.SystemStatus).delete()
+        add_active_violation(db, pwsids[0])
+
+    clusters, pwsids = with_systems(
+        [(30.0, -60.0)], lambda db: tiles.get_tile_clusters(db, z, x, y), prepare=before_first_ingest
+    )
+    (properties,) = [f["properties"] for f in clusters["features"] if f["properties"]["pwsid"] == pwsids[0]]
+    assert properties["not_safe_count"] == 1
+
+def test_tile_endpoints(client, postgis):
+    z = 10
+    x, y = tile_of(33.75, -84.39, z)
+    response = client.get(f"/tiles/{z}/{x}/{y}.mvt")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == tiles.MVT_MEDIA_TYPE
+
+    response = client.get(f"/tiles/{z}/{x}/{y}.geojson")
+    assert response.status_code == 200
+    assert response.json()["type"] == "FeatureCollection"
+
+def test_tiles_outside_the_zoom_level_are_not_found(client):
+    assert client.get("/tiles/2/4/0.mvt").status_code == 404
+    assert client.get("/tiles/23/0/0.geojson").status_code == 404
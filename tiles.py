@@ -0,0 +1,110 @@
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+MAX_ZOOM = 22
+MVT_EXTENT = 4096
+# Points this close outside a tile are still encoded so markers aren't cut at tile edges.
+MVT_BUFFER = 256
+# The clustered view merges points on a grid of this many cells per tile side.
+CLUSTER_GRID = 8
+WEB_MERCATOR_WIDTH = 40075016.685578488
+
+# Systems without a system_status row yet are checked live, as crud.status_column does.
+_STATUS_SQL = """
+    COALESCE(s.status, CASE WHEN EXISTS (
+        SELECT 1 FROM sdwa_violations_enforcement v
+        WHERE v.pwsid = g.pwsid AND v.is_health_based_ind = 'Y' AND v.non_compl_per_end_date IS NULL
+    ) THEN :not_safe_status ELSE :default_status END)
+"""
+
+# Parameters are cast explicitly: asyncpg has the server infer their types,
+# which fails or picks the wrong overload for some of these functions.
+_TILE_SQL = text(f"""
+    WITH bounds AS (
+        SELECT CAST(envelope AS box2d) AS envelope,
+               ST_Transform(ST_Expand(envelope, CAST(:margin AS float8)), 4326) AS search_area
+        FROM ST_TileEnvelope(CAST(:z AS integer), CAST(:x AS integer), CAST(:y AS integer)) AS tile_bounds(envelope)
+    )
+    SELECT ST_AsMVT(tile, 'systems', CAST(:extent AS integer), 'geom')
+    FROM (
+        SELECT ST_AsMVTGeom(
+                   ST_Transform(g.geom, 3857), bounds.envelope, CAST(:extent AS integer), CAST(:buffer AS integer)
+               ) AS geom,
+               g.pwsid,
+               p.pws_name,
+               {_STATUS_SQL} AS status
+        FROM bounds
+        JOIN sdwa_geographic_areas g ON g.geom && bounds.search_area
+        JOIN sdwa_pub_water_systems p ON p.pwsid = g.pwsid
+        LEFT JOIN system_status s ON s.pwsid = g.pwsid
+    ) tile;
+""")
+
+_CLUSTERS_SQL = text(f"""
+    WITH points AS (
+        SELECT ST_Transform(g.geom, 3857) AS geom, g.pwsid, {_STATUS_SQL} AS status
+        FROM sdwa_geographic_areas g
+        LEFT JOIN system_status s ON s.pwsid = g.pwsid
+        WHERE g.geom && ST_Transform(
+            ST_TileEnvelope(CAST(:z AS integer), CAST(:x AS integer), CAST(:y AS integer)), 4326
+        )
+    )
+    SELECT ST_X(center) AS lon, ST_Y(center) AS lat, system_count, not_safe_count, pwsid
+    FROM (
+        SELECT ST_Transform(ST_Centroid(ST_Collect(geom)), 4326) AS center,
+               COUNT(DISTINCT pwsid) AS system_count,
+               COUNT(DISTINCT pwsid) FILTER (WHERE status <> :default_status) AS not_safe_count,
+               MIN(pwsid) AS pwsid
+        FROM points
+        GROUP BY ST_SnapToGrid(geom, CAST(:cell_size AS float8))
+    ) clusters;
+""")
+
+
+def tile_width(z: int):
+    """Width of a zoom `z` tile in web-mercator metres."""
+    return WEB_MERCATOR_WIDTH / 2 ** z
+
+def check_tile(z: int, x: int, y: int):
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail=f"No tile {z}/{x}/{y}")
+
+async def get_tile(db: AsyncSession, z: int, x: int, y: int):
+    """Encodes the systems in tile z/x/y, with their status, as a Mapbox vector tile."""
+    tile = await db.scalar(_TILE_SQL, {
+        "z": z, "x": x, "y": y,
+        "margin": tile_width(z) * MVT_BUFFER / MVT_EXTENT,
+        "extent": MVT_EXTENT,
+        "buffer": MVT_BUFFER,
+        "default_status": crud.status_from_count(0),
+        "not_safe_status": crud.status_from_count(1),
+    })
+    return bytes(tile or b"")
+
+async def get_tile_clusters(db: AsyncSession, z: int, x: int, y: int):
+    """GeoJSON clusters of the systems in tile z/x/y; a cluster of one system carries its pwsid."""
+    rows = await db.execute(_CLUSTERS_SQL, {
+        "z": z, "x": x, "y": y,
+        "cell_size": tile_width(z) / CLUSTER_GRID,
+        "default_status": crud.status_from_count(0),
+        "not_safe_status": crud.status_from_count(1),
+    })
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [row.lon, row.lat]},
+                "properties": {
+                    "system_count": row.system_count,
+                    "not_safe_count": row.not_safe_count,
+                    "pwsid": row.pwsid if row.system_count == 1 else None,
+                },
+            }
+            for row in rows
+        ],
+    }